@@ -0,0 +1,217 @@
+"""
+Columnar batch analytics of lexical metrics over transcript archives.
+
+Computes speech rate, filler rate, positive-word probability and MTLD, plus
+their rubric scores, for every submission in a .jsonl, .csv or .parquet file
+without going through grade(). Submissions are processed in chunks: tokens are
+interned into a vocabulary shared by the whole run, the VADER lexicon becomes
+a boolean array indexed by token id, and per-text counts, rates and band
+scores are NumPy reductions over the chunk. Bands come from the same tables as
+the per-request graders, so every number matches analyze_introduction.
+
+Filler phrases are matched like FillerWordRate does (substrings, multi-word
+phrases, distinct phrases counted), which a per-token lookup can't reproduce,
+so they stay one compiled-regex scan per text.
+
+Output is one row per submission with the columns in COLUMNS, written as
+.jsonl, .csv or .parquet (parquet needs pyarrow).
+
+Usage:
+    python3 analytics.py archive.parquet metrics.parquet --chunk-size 50000
+    python3 analytics.py submissions.jsonl metrics.csv
+"""
+import argparse
+import csv
+import json
+import math
+import sys
+
+import numpy as np
+
+from main import (
+    FILLER_RATE_BANDS, FILLER_RATE_DEFAULT, RICHNESS_BANDS, RICHNESS_DEFAULT,
+    SENTIMENT_BANDS, SENTIMENT_DEFAULT, SPEECH_RATE_BANDS, SPEECH_RATE_DEFAULT,
+    Document, find_fillers, get_sentiment_analyzer,
+)
+from lexical_diversity import mtld
+from rescore import read_submissions
+
+COLUMNS = [
+    'index', 'id', 'word_count', 'duration', 'speech_rate', 'speech_rate_score',
+    'filler_count', 'filler_rate', 'filler_score', 'token_count', 'positive_count',
+    'positive_probability', 'sentiment_score', 'mtld', 'richness_score',
+]
+
+
+class Vocabulary:
+    """Token -> id interning, with the VADER positive flag of every id"""
+    def __init__(self, lexicon):
+        self.lexicon = lexicon
+        self.ids = {}
+        self.positive = []
+
+    def intern(self, tokens):
+        ids = self.ids
+        result = []
+        for token in tokens:
+            token_id = ids.get(token)
+            if token_id is None:
+                token_id = ids[token] = len(ids)
+                self.positive.append(self.lexicon.get(token, 0) > 0)
+            result.append(token_id)
+        return result
+
+    def positive_mask(self):
+        return np.array(self.positive, dtype=bool)
+
+
+def band_scores(values, bands, default):
+    """Vectorized find_band: the score of the first band containing each value"""
+    conditions = [(values >= low) & (values <= high) for low, high, *_ in bands]
+    return np.select(conditions, [score for _, _, score, *_ in bands], default)
+
+
+def round_like_python(values, digits):
+    """round() per element: np.round can differ at halfway cases, which would shift bands"""
+    return np.array([round(value, digits) for value in values.tolist()], dtype=float)
+
+
+def analyze_chunk(items, start, vocabulary):
+    """Metrics for one chunk of submissions as {column: array}"""
+    count = len(items)
+    word_counts = np.zeros(count, dtype=np.int64)
+    durations = np.full(count, np.nan)
+    filler_counts = np.zeros(count, dtype=np.int64)
+    mtlds = np.full(count, np.nan)
+    token_ids = []
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    ids = []
+
+    for i, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        ids.append(item.get('id'))
+        text = item.get('introduction')
+        try:
+            durations[i] = float(item.get('duration'))
+        except (TypeError, ValueError):
+            pass
+        if isinstance(text, str):
+            doc = Document(text)
+            word_counts[i] = doc.word_count
+            filler_counts[i] = len(find_fillers(doc.lowered))
+            token_ids.extend(vocabulary.intern(doc.tokens))
+            # Same as Richness: no words scores as MTLD 0
+            mtlds[i] = mtld(doc.lexical_tokens) if doc.lexical_tokens else 0.0
+        offsets[i + 1] = len(token_ids)
+
+    token_counts = np.diff(offsets)
+    # Cumulative sums give per-text totals even for texts without tokens
+    positive_cumulative = np.concatenate(([0], np.cumsum(vocabulary.positive_mask()[np.array(token_ids, dtype=np.int64)])))
+    positive_counts = positive_cumulative[offsets[1:]] - positive_cumulative[offsets[:-1]]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        words = np.where(word_counts > 0, word_counts, np.nan)
+        minutes = np.where(durations > 0, durations, np.nan) / 60
+        speech_rates = word_counts / minutes
+        filler_rates = filler_counts / words * 100
+        probabilities = round_like_python(positive_counts / np.maximum(token_counts, 1), 4)
+        richness = mtlds / 100
+
+    return {
+        'index': np.arange(start, start + count),
+        'id': ids,
+        'word_count': word_counts,
+        'duration': durations,
+        'speech_rate': round_like_python(speech_rates, 2),
+        'speech_rate_score': np.where(np.isnan(speech_rates), 0, band_scores(speech_rates, SPEECH_RATE_BANDS, SPEECH_RATE_DEFAULT)),
+        'filler_count': filler_counts,
+        'filler_rate': round_like_python(filler_rates, 2),
+        'filler_score': np.where(np.isnan(filler_rates), 0, band_scores(filler_rates, FILLER_RATE_BANDS, FILLER_RATE_DEFAULT)),
+        'token_count': token_counts,
+        'positive_count': positive_counts,
+        'positive_probability': probabilities,
+        'sentiment_score': band_scores(probabilities, SENTIMENT_BANDS, SENTIMENT_DEFAULT),
+        'mtld': round_like_python(richness, 3),
+        'richness_score': np.where(np.isnan(richness), 0, band_scores(richness, RICHNESS_BANDS, RICHNESS_DEFAULT)),
+    }
+
+
+def read_items(path, chunk_size):
+    """Yields lists of submission dicts; parquet is read in record batches"""
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pylist()
+        return
+    chunk = []
+    for item in read_submissions(path):
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def rows(columns):
+    """Row dicts with plain Python values (NaN -> None)"""
+    values = [columns[name].tolist() if isinstance(columns[name], np.ndarray) else columns[name] for name in COLUMNS]
+    for row in zip(*values):
+        yield {name: None if isinstance(value, float) and math.isnan(value) else value for name, value in zip(COLUMNS, row)}
+
+
+class Writer:
+    def __init__(self, path):
+        self.path = path
+        self.parquet = None
+        self.csv = None
+        if path.endswith('.parquet'):
+            self.file = None
+        else:
+            self.file = open(path, 'w', newline='', encoding='utf-8')
+            if path.endswith('.csv'):
+                self.csv = csv.DictWriter(self.file, fieldnames=COLUMNS)
+                self.csv.writeheader()
+
+    def write(self, columns):
+        if self.file is None:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.table({name: list(columns[name]) if name == 'id' else columns[name] for name in COLUMNS})
+            if self.parquet is None:
+                self.parquet = pq.ParquetWriter(self.path, table.schema)
+            self.parquet.write_table(table)
+        elif self.csv is not None:
+            self.csv.writerows(rows(columns))
+        else:
+            for row in rows(columns):
+                self.file.write(json.dumps(row) + "\n")
+
+    def close(self):
+        if self.parquet is not None:
+            self.parquet.close()
+        if self.file is not None:
+            self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute lexical metrics over a transcript archive')
+    parser.add_argument('input', help='Input .jsonl, .csv or .parquet file')
+    parser.add_argument('output', help='Output .jsonl, .csv or .parquet file')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='Submissions per vectorized chunk')
+    args = parser.parse_args()
+
+    vocabulary = Vocabulary(get_sentiment_analyzer().lexicon)
+    writer = Writer(args.output)
+    count = 0
+    try:
+        for chunk in read_items(args.input, args.chunk_size):
+            writer.write(analyze_chunk(chunk, count, vocabulary))
+            count += len(chunk)
+            print(f"Analyzed {count} submissions ({len(vocabulary.ids)} distinct tokens)", file=sys.stderr)
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Benchmark harness for the grading pipeline.
+
+Generates a deterministic synthetic corpus of introductions and times
+analyze_introduction, each grade() criterion, check_flow_order and
+KeywordGrader.calculate_keyword_score against it. Prints a JSON report with
+p50/p95/p99 latency, throughput and peak RSS so runs can be diffed.
+Cold start (fresh process: import, model load, first request) is measured in
+a subprocess and reported separately from warm numbers. The result cache is
+disabled so every call does the full work.
+
+Usage:
+    python3 bench.py --sizes 30,150,600,3000 --repeat 5 --output bench.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+SECTION_SENTENCES = {
+    'salutation': {
+        'basic': ["Hi", "Hello", "Hey there"],
+        'mid': ["Good morning everyone", "Hello everyone", "Good afternoon everyone"],
+        'strong': ["I am excited to introduce myself", "I'm so excited to be here today", "I am thrilled to be here"],
+    },
+    'name': ["My name is {name}", "Myself {name}", "People call me {name}", "I go by {name}"],
+    'mandatory': ["I am {age} years old", "I study in class {grade} at {school}",
+                  "I live with my family, my mother, my father and my {count} siblings",
+                  "My parents work very hard for our family"],
+    'optional': ["My hobbies are {hobby} and {hobby}", "I like to play {hobby} in my free time",
+                 "My dream is to become a {job}", "One fun fact about me is that I can {skill}",
+                 "I am from {city} and I was born in {city}", "My greatest strength is that I am good at {skill}"],
+    'closing': ["Thank you for listening", "That's all about me, thank you", "Thanks for your time"],
+}
+FILLERS = ["um", "uh", "like", "you know", "actually", "basically", "I mean", "kinda", "sort of", "hmm"]
+GRAMMAR_ERRORS = ["He go to school every day", "I has two brothers", "They was very happy",
+                  "me and him plays cricket", "She don't like apples"]
+PADDING = ["{topic} is something I think about a lot", "I spend many evenings reading about {topic}",
+           "My friends and I often talk about {topic} after class", "Learning about {topic} makes me happy",
+           "Last year I visited {city} with my cousins", "I want to improve my {topic} skills this year"]
+VALUES = {
+    'name': ["Asha", "Ravi", "Muskan", "Arjun", "Meera", "Kabir"],
+    'age': ["12", "13", "14", "15"],
+    'grade': ["7", "8", "9", "10"],
+    'school': ["Christ Public School", "Green Valley School", "City Model School"],
+    'count': ["two", "three"],
+    'hobby': ["cricket", "painting", "reading", "chess", "football", "music"],
+    'job': ["doctor", "pilot", "scientist", "teacher", "engineer"],
+    'skill': ["solve puzzles quickly", "draw portraits", "speak three languages", "juggle"],
+    'city': ["Pune", "Delhi", "Jaipur", "Chennai", "Kochi"],
+    'topic': ["science", "history", "space", "music", "mathematics", "nature", "computers"],
+}
+
+
+def fill(template, rng):
+    for key, options in VALUES.items():
+        while '{' + key + '}' in template:
+            template = template.replace('{' + key + '}', rng.choice(options), 1)
+    return template
+
+
+def synthetic_introduction(seed, words=150, salutation='mid', filler_rate=0.0, grammar_errors=0,
+                           order='correct', words_per_minute=125):
+    """
+    Deterministic synthetic introduction of roughly `words` words.
+    salutation: 'basic', 'mid', 'strong' or None; filler_rate: fraction of
+    sentences that get a filler; grammar_errors: number of ungrammatical
+    sentences; order: 'correct', 'shuffled' or 'reversed' section order.
+    Returns (text, duration_seconds).
+    """
+    rng = random.Random(seed)
+    sections = []
+    if salutation:
+        sections.append([rng.choice(SECTION_SENTENCES['salutation'][salutation])])
+    sections.append([fill(rng.choice(SECTION_SENTENCES['name']), rng)])
+    sections.append([fill(sentence, rng) for sentence in rng.sample(SECTION_SENTENCES['mandatory'], 2)])
+    sections.append([fill(sentence, rng) for sentence in rng.sample(SECTION_SENTENCES['optional'], 3)])
+    closing = [rng.choice(SECTION_SENTENCES['closing'])]
+
+    # Pad the optional section until the target length is reached
+    count = sum(len(s.split()) for section in sections for s in section) + len(closing[0].split())
+    while count < words:
+        sentence = fill(rng.choice(PADDING), rng)
+        sections[-1].append(sentence)
+        count += len(sentence.split())
+    sections.append(closing)
+
+    for _ in range(grammar_errors):
+        sections[-2].insert(rng.randrange(len(sections[-2]) + 1), rng.choice(GRAMMAR_ERRORS))
+
+    if order == 'shuffled':
+        rng.shuffle(sections)
+    elif order == 'reversed':
+        sections.reverse()
+
+    sentences = [sentence for section in sections for sentence in section]
+    if filler_rate:
+        for i, sentence in enumerate(sentences):
+            if rng.random() < filler_rate:
+                first, _, rest = sentence.partition(' ')
+                if first != 'I' and not first.startswith("I'"):
+                    first = first.lower()
+                sentences[i] = f"{rng.choice(FILLERS)}, {first} {rest}".rstrip()
+
+    text = '. '.join(sentences) + '.'
+    duration = round(len(text.split()) / words_per_minute * 60, 1)
+    return text, duration
+
+
+def build_corpus(sizes, per_size=5, seed=0):
+    """Mix of salutation levels, filler rates, grammar errors and section orders per size"""
+    corpus = []
+    variants = [
+        {'salutation': 'mid', 'filler_rate': 0.0, 'grammar_errors': 0, 'order': 'correct'},
+        {'salutation': 'basic', 'filler_rate': 0.3, 'grammar_errors': 2, 'order': 'correct'},
+        {'salutation': 'strong', 'filler_rate': 0.1, 'grammar_errors': 1, 'order': 'shuffled'},
+        {'salutation': None, 'filler_rate': 0.5, 'grammar_errors': 4, 'order': 'reversed'},
+    ]
+    for size in sizes:
+        for i in range(per_size):
+            variant = variants[i % len(variants)]
+            text, duration = synthetic_introduction(seed * 100003 + size * 1009 + i, size, **variant)
+            corpus.append({'size': size, 'variant': variant, 'text': text, 'duration': duration})
+    return corpus
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    k = (len(values) - 1) * q
+    low, high = int(k), min(int(k) + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def summarize(latencies):
+    total = sum(latencies)
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(total / len(latencies) * 1000, 3),
+        'throughput_per_s': round(len(latencies) / total, 2) if total else None,
+    }
+
+
+def time_calls(fn, items, repeat):
+    latencies = []
+    for _ in range(repeat):
+        for item in items:
+            start = time.perf_counter()
+            fn(item)
+            latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def cold_start(criteria=None):
+    """Runs a fresh process that imports main, loads models and grades one text"""
+    command = [sys.executable, os.path.abspath(__file__), '--cold-child']
+    if criteria:
+        command += ['--criteria', ','.join(criteria)]
+    env = dict(os.environ, GRADER_CACHE_SIZE='0')
+    env.pop('GRADER_CACHE_PATH', None)
+    output = subprocess.run(command, capture_output=True, text=True, env=env, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def cold_child(criteria=None):
+    start = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+    main.warmup(criteria)
+    loaded = time.perf_counter()
+    text, duration = synthetic_introduction(0, 150)
+    main.analyze_introduction(text, duration, criteria=criteria)
+    done = time.perf_counter()
+    print(json.dumps({
+        'import_s': round(imported - start, 4),
+        'model_load_s': round(loaded - imported, 4),
+        'first_request_s': round(done - loaded, 4),
+        'total_s': round(done - start, 4),
+        'components': main.startup_report()['components'],
+        'peak_rss_mb': peak_rss_mb(),
+    }))
+
+
+def run(sizes, per_size, repeat, criteria=None, seed=0, include_cold=True):
+    report = {'config': {'sizes': sizes, 'per_size': per_size, 'repeat': repeat, 'criteria': criteria, 'seed': seed}}
+    if include_cold:
+        report['cold'] = cold_start(criteria)
+
+    import main
+    # Repeated texts must be graded every time, grammar included
+    main.configure_cache(max_entries=0, path='')
+    main.GRAMMAR_CACHE = None
+    main.warmup(criteria)
+    corpus = build_corpus(sizes, per_size, seed)
+    weights = {'Salutation': 5, 'KeyWord': 30, 'Flow': 5, 'SpeechRate': 10,
+               'Error': 10, 'Richness': 10, 'FillerWordRate': 15, 'Sentiment': 15}
+    enabled = [c for c in weights if criteria is None or c in criteria]
+
+    # One untimed pass so lazy initialisation doesn't count as warm latency
+    for item in corpus[:1]:
+        main.analyze_introduction(item['text'], item['duration'], criteria=criteria)
+
+    warm = {}
+    for size in sizes:
+        items = [item for item in corpus if item['size'] == size]
+        results = {
+            'analyze_introduction': time_calls(
+                lambda item: main.analyze_introduction(item['text'], item['duration'], criteria=criteria), items, repeat),
+            'check_flow_order': time_calls(lambda item: main.check_flow_order(item['text']), items, repeat),
+        }
+        if 'KeyWord' in enabled:
+            keyword_grader = main.get_keyword_grader()
+            results['calculate_keyword_score'] = time_calls(
+                lambda item: keyword_grader.calculate_keyword_score(item['text']), items, repeat)
+        for criterion in enabled:
+            results[f'grade.{criterion}'] = time_calls(
+                lambda item: main.grade(item['text'], None, None, {criterion: weights[criterion]}, item['duration']),
+                items, repeat)
+        warm[str(size)] = results
+
+    report['warm'] = warm
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Benchmark the grading pipeline')
+    parser.add_argument('--sizes', default='30,150,600,3000', help='Comma-separated word counts')
+    parser.add_argument('--per-size', type=int, default=5, help='Synthetic texts per size')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed passes over the corpus')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--criteria', help='Comma-separated rubric subset')
+    parser.add_argument('--no-cold', action='store_true', help='Skip the cold-start subprocess')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--cold-child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    criteria = [c.strip() for c in args.criteria.split(',')] if args.criteria else None
+
+    if args.cold_child:
+        cold_child(criteria)
+        return
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    report = run(sizes, args.per_size, args.repeat, criteria, args.seed, not args.no_cold)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,146 @@
+"""
+Embedding backends for the sentence model.
+
+    torch  full-precision PyTorch (default)
+    int8   PyTorch with dynamic int8 quantization of every Linear layer
+    onnx   ONNX Runtime via sentence-transformers' backend="onnx"
+           (sentence-transformers>=3.2 with optimum[onnxruntime])
+
+Every backend is a SentenceTransformer, so KeywordGrader and encode_texts use
+them unchanged. drift_report() compares a backend against fp32 on a reference
+set and lists every KeyWord category decision that flips at the threshold.
+
+Usage:
+    python3 embedding_backends.py --backend int8 --threads 4
+    python3 embedding_backends.py --backend onnx --per-size 20 --output drift.json
+Exits with status 1 when any category decision flips.
+"""
+import argparse
+import json
+import sys
+import time
+
+BACKENDS = ('torch', 'int8', 'onnx')
+
+
+def load_sentence_model(name, backend='torch', threads=None):
+    """
+    Loads the sentence model with the given backend. threads sets intra-op
+    parallelism (torch.set_num_threads, or the ONNX Runtime session's
+    intra_op_num_threads); None keeps the library default.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if threads:
+        torch.set_num_threads(threads)
+
+    if backend == 'onnx':
+        model_kwargs = {}
+        if threads:
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = threads
+            model_kwargs['session_options'] = options
+        return SentenceTransformer(name, backend='onnx', model_kwargs=model_kwargs)
+
+    model = SentenceTransformer(name)
+    if backend == 'int8':
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+
+def category_similarities(keyword_grader, texts, batch_size=32):
+    """{category: [best similarity per text]} with score_embedding's semantics (floored at 0)"""
+    embeddings = keyword_grader.model.encode(
+        [text.lower() for text in texts],
+        batch_size=batch_size, convert_to_tensor=True, normalize_embeddings=True
+    )
+    similarities = (keyword_grader.keyword_matrix @ embeddings.T).tolist()
+    return {
+        category: [max([0] + [similarities[row][i] for row in range(start, end)]) for i in range(len(texts))]
+        for category, (start, end) in keyword_grader.category_offsets.items()
+    }
+
+
+def drift_report(texts, candidate, reference, threshold=0.2):
+    """
+    Compares two KeywordGraders (candidate backend vs fp32 reference) on texts.
+    Reports the absolute similarity drift per category and every text/category
+    whose matched/missing decision differs between them.
+    """
+    started = time.perf_counter()
+    candidate_scores = category_similarities(candidate, texts)
+    candidate_time = time.perf_counter() - started
+    started = time.perf_counter()
+    reference_scores = category_similarities(reference, texts)
+    reference_time = time.perf_counter() - started
+
+    categories = {}
+    flips = []
+    all_drifts = []
+    for category, reference_values in reference_scores.items():
+        drifts = [abs(c - r) for c, r in zip(candidate_scores[category], reference_values)]
+        all_drifts.extend(drifts)
+        categories[category] = {'max_drift': round(max(drifts), 5), 'mean_drift': round(sum(drifts) / len(drifts), 5)}
+        for i, (c, r) in enumerate(zip(candidate_scores[category], reference_values)):
+            if (c >= threshold) != (r >= threshold):
+                flips.append({
+                    'text': i, 'category': category,
+                    'reference': round(r, 5), 'candidate': round(c, 5),
+                })
+
+    return {
+        'texts': len(texts),
+        'threshold': threshold,
+        'max_drift': round(max(all_drifts), 5),
+        'mean_drift': round(sum(all_drifts) / len(all_drifts), 5),
+        'categories': categories,
+        'flips': flips,
+        'encode_seconds': {'candidate': round(candidate_time, 4), 'reference': round(reference_time, 4)},
+    }
+
+
+def reference_texts(per_size=10, sizes=(30, 150, 600), seed=0):
+    """Synthetic introductions from the benchmark corpus"""
+    from bench import synthetic_introduction
+
+    texts = []
+    for size in sizes:
+        for i in range(per_size):
+            salutation = ['basic', 'mid', 'strong', None][i % 4]
+            order = ['correct', 'shuffled', 'reversed'][i % 3]
+            text, _ = synthetic_introduction(seed + size * 1000 + i, size, salutation, order=order)
+            texts.append(text)
+    return texts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Report embedding drift of a backend against fp32')
+    parser.add_argument('--backend', default='int8', choices=BACKENDS)
+    parser.add_argument('--threads', type=int, help='Intra-op threads for both models')
+    parser.add_argument('--per-size', type=int, default=10, help='Reference texts per size')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    from main import SENTENCE_MODEL_NAME, KeywordGrader
+
+    texts = reference_texts(args.per_size)
+    reference = KeywordGrader(load_sentence_model(SENTENCE_MODEL_NAME, 'torch', args.threads))
+    candidate = KeywordGrader(load_sentence_model(SENTENCE_MODEL_NAME, args.backend, args.threads))
+    report = drift_report(texts, candidate, reference, args.threshold)
+    report['backend'] = args.backend
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if report['flips']:
+        print(f"{len(report['flips'])} category decisions flip at {args.threshold}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,241 @@
+"""
+Pool of LanguageTool backends for grammar checking.
+
+Each backend is a LanguageToolClient of one server: either a local server
+process (one JVM each, started by language_tool_python) or an already running
+server given by URL. Clients post to /v2/check over their own requests.Session,
+so the HTTP connection is kept alive between checks instead of opened per
+check as language_tool_python's module-level requests.post does. A check
+takes whichever backend is idle, so up to `size` checks run at once.
+A backend that fails is restarted and the check retried once on another one;
+if that fails too, GrammarUnavailable is raised so callers can report the
+metric as degraded instead of scoring it as error-free. A daemon thread
+health-checks idle backends every health_interval seconds.
+"""
+import os
+import queue
+import sys
+import threading
+import time
+import unicodedata
+import urllib.parse
+
+# Seconds a check waits for the server, as in language_tool_python
+REQUEST_TIMEOUT = 300
+
+
+class GrammarUnavailable(Exception):
+    pass
+
+
+def utf16_offsets(text):
+    """Maps LanguageTool's UTF-16 offsets to str indices, None when they are the same"""
+    if all(ord(char) <= 0xFFFF for char in text):
+        return None
+    indices = []
+    for index, char in enumerate(text):
+        indices.append(index)
+        if ord(char) > 0xFFFF:
+            indices.append(index)
+    indices.append(len(text))
+    return indices
+
+
+class LanguageToolClient:
+    def __init__(self, language, url=None):
+        """
+        url: a running LanguageTool server; without one a local server is
+        started through language_tool_python, which also stops it on close()
+        """
+        import requests
+
+        self.language = language
+        self.server = None
+        if url is None:
+            import language_tool_python
+
+            self.server = language_tool_python.LanguageTool(language)
+            self.url = self.server.url
+        else:
+            self.url = urllib.parse.urljoin(url if url.endswith('/') else url + '/', 'v2/')
+        self.session = requests.Session()
+        # Asking once also makes a freshly started server load its rules before the first real check
+        self.version = None
+        self.check('Hello.')
+
+    def identity(self):
+        """Which rules answer: the server's version and build, plus its URL when it is not ours"""
+        return self.version if self.server is not None else f'{self.url} {self.version}'
+
+    def check(self, text):
+        """
+        Matches for text as dicts with the offset, length, message, context
+        and replacements fields of language_tool_python's Match
+        """
+        response = self.session.post(
+            self.url + 'check', data={'language': self.language, 'text': text}, timeout=REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        body = response.json()
+        software = body.get('software', {})
+        self.version = f"LanguageTool {software.get('version')} ({software.get('buildDate')})"
+        offsets = utf16_offsets(text)
+        matches = []
+        for match in body['matches']:
+            offset, length = match['offset'], match['length']
+            if offsets is not None:
+                offset, length = offsets[offset], offsets[offset + length] - offsets[offset]
+            matches.append({
+                'offset': offset,
+                'length': length,
+                'message': unicodedata.normalize('NFKC', match['message']),
+                'context': match['context']['text'],
+                'replacements': [replacement['value'] for replacement in match['replacements']],
+            })
+        return matches
+
+    def after_fork(self):
+        """A new session: pooled connections must not be shared with the parent"""
+        import requests
+
+        self.session = requests.Session()
+
+    def close(self):
+        self.session.close()
+        if self.server is not None:
+            self.server.close()
+
+
+class GrammarPool:
+    def __init__(self, language='en-US', size=1, urls=None, heap=None, health_interval=30, checkout_timeout=30):
+        """
+        size: local servers to start (ignored when urls is given)
+        urls: running LanguageTool servers to connect to, one backend each
+        heap: JVM max heap for local servers, e.g. "512m"
+        health_interval: seconds between idle health checks (0 disables them)
+        checkout_timeout: seconds a check waits for a free backend
+        """
+        self.language = language
+        self.urls = list(urls) if urls else [None] * size
+        self.heap = heap
+        self.checkout_timeout = checkout_timeout
+        self.backends = [None] * len(self.urls)
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.stats = {'checks': 0, 'failures': 0, 'restarts': 0, 'health_checks': 0, 'unavailable': 0}
+        self.closed = False
+
+        for index in range(len(self.urls)):
+            self.backends[index] = self._start(index)
+            self.idle.put(index)
+
+        if health_interval:
+            self.health_interval = health_interval
+            threading.Thread(target=self._health_loop, daemon=True, name='grammar-health').start()
+
+    def _start(self, index):
+        url = self.urls[index]
+        if url:
+            return LanguageToolClient(self.language, url)
+        if self.heap:
+            # language_tool_python starts the JVM itself; the JVM reads its options from here
+            options = os.environ.get('JAVA_TOOL_OPTIONS', '')
+            if f'-Xmx{self.heap}' not in options:
+                os.environ['JAVA_TOOL_OPTIONS'] = f'{options} -Xmx{self.heap}'.strip()
+        return LanguageToolClient(self.language)
+
+    def _restart(self, index):
+        print(f"Restarting grammar backend {index}", file=sys.stderr)
+        try:
+            self.backends[index].close()
+        except Exception:
+            pass
+        with self.lock:
+            self.stats['restarts'] += 1
+        try:
+            self.backends[index] = self._start(index)
+            return True
+        except Exception as e:
+            print(f"Grammar backend {index} failed to start: {e}", file=sys.stderr)
+            return False
+
+    def check(self, text):
+        """LanguageToolClient.check matches for text; raises GrammarUnavailable when no backend can answer"""
+        last_error = None
+        for _ in range(2):
+            try:
+                index = self.idle.get(timeout=self.checkout_timeout)
+            except queue.Empty:
+                last_error = f"no grammar backend free within {self.checkout_timeout}s"
+                break
+            try:
+                matches = self.backends[index].check(text)
+                with self.lock:
+                    self.stats['checks'] += 1
+                return matches
+            except Exception as e:
+                last_error = str(e)
+                with self.lock:
+                    self.stats['failures'] += 1
+                print(f"Grammar backend {index} failed: {e}", file=sys.stderr)
+                self._restart(index)
+            finally:
+                self.idle.put(index)
+        with self.lock:
+            self.stats['unavailable'] += 1
+        raise GrammarUnavailable(last_error)
+
+    def identity(self):
+        """Versions of the servers behind the backends, to key cached matches by"""
+        return sorted({backend.identity() for backend in self.backends if backend is not None})
+
+    def check_health(self):
+        """Checks every idle backend with a tiny request, restarting the ones that fail"""
+        for _ in range(self.idle.qsize()):
+            try:
+                index = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                self.backends[index].check('Hello.')
+            except Exception as e:
+                print(f"Grammar backend {index} unhealthy: {e}", file=sys.stderr)
+                self._restart(index)
+            finally:
+                with self.lock:
+                    self.stats['health_checks'] += 1
+                self.idle.put(index)
+
+    def _health_loop(self):
+        while not self.closed:
+            time.sleep(self.health_interval)
+            if not self.closed:
+                self.check_health()
+
+    def after_fork(self):
+        """
+        Reinitializes locks, the idle queue and HTTP sessions in a forked child,
+        which shares the parent's servers but not its connections or
+        health-check thread
+        """
+        self.lock = threading.Lock()
+        self.idle = queue.Queue()
+        for index, backend in enumerate(self.backends):
+            backend.after_fork()
+            self.idle.put(index)
+
+    def close(self):
+        self.closed = True
+        for backend in self.backends:
+            try:
+                backend.close()
+            except Exception:
+                pass
+
+    def report(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['size'] = len(self.backends)
+        stats['idle'] = self.idle.qsize()
+        stats['remote'] = any(self.urls)
+        return stats
@@ -0,0 +1,163 @@
+"""
+Timing, metrics and sampling-profiler hooks for the grader.
+
+timed(name) measures wall and CPU time of a block. Measurements go to the
+per-request collector started with collect() (if any) and to process-wide
+cumulative histograms that the worker can dump as JSON or Prometheus text.
+The per-request collector lives in a ContextVar, so work handed to a thread
+pool must run inside contextvars.copy_context() to be attributed.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+
+# Upper bounds in seconds; the last bucket is +Inf
+HISTOGRAM_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+_current = ContextVar('grader_timings', default=None)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.cpu_sum = 0.0
+
+    def observe(self, wall, cpu):
+        self.count += 1
+        self.sum += wall
+        self.cpu_sum += cpu
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if wall <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, wall, cpu):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(wall, cpu)
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_json(self):
+        with self.lock:
+            steps = {}
+            for name, h in sorted(self.histograms.items()):
+                cumulative, buckets = 0, {}
+                for bound, count in zip(HISTOGRAM_BUCKETS + ['+Inf'], h.counts):
+                    cumulative += count
+                    buckets[str(bound)] = cumulative
+                steps[name] = {
+                    'count': h.count,
+                    'wall_seconds_sum': round(h.sum, 6),
+                    'cpu_seconds_sum': round(h.cpu_sum, 6),
+                    'buckets': buckets,
+                }
+            return {'steps': steps, 'counters': dict(self.counters)}
+
+    def to_prometheus(self):
+        lines = [
+            '# HELP grader_step_seconds Wall time per grading step',
+            '# TYPE grader_step_seconds histogram',
+        ]
+        with self.lock:
+            for name, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(HISTOGRAM_BUCKETS + ['+Inf'], h.counts):
+                    cumulative += count
+                    lines.append(f'grader_step_seconds_bucket{{step="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'grader_step_seconds_sum{{step="{name}"}} {h.sum:.6f}')
+                lines.append(f'grader_step_seconds_count{{step="{name}"}} {h.count}')
+            lines.append('# HELP grader_step_cpu_seconds_total CPU time per grading step')
+            lines.append('# TYPE grader_step_cpu_seconds_total counter')
+            for name, h in sorted(self.histograms.items()):
+                lines.append(f'grader_step_cpu_seconds_total{{step="{name}"}} {h.cpu_sum:.6f}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'# TYPE grader_{name}_total counter')
+                lines.append(f'grader_{name}_total {value}')
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+@contextmanager
+def collect():
+    """Collects the timings of everything timed inside this block into a dict"""
+    timings = {}
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """Records wall and CPU (current thread) time of the block under name"""
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.thread_time() - cpu_start
+        METRICS.observe(name, wall, cpu)
+        timings = _current.get()
+        if timings is not None:
+            entry = timings.setdefault(name, {'wall_ms': 0.0, 'cpu_ms': 0.0, 'calls': 0})
+            entry['wall_ms'] = round(entry['wall_ms'] + wall * 1000, 3)
+            entry['cpu_ms'] = round(entry['cpu_ms'] + cpu * 1000, 3)
+            entry['calls'] += 1
+
+
+class SamplingProfiler:
+    """
+    Profiles every Nth call with cProfile and writes the stats to output_dir.
+    Only the calling thread is profiled, so use it with sequential grading.
+    """
+    def __init__(self, every, output_dir='.', top=25):
+        self.every = every
+        self.output_dir = output_dir
+        self.top = top
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.last_summary = None
+
+    def should_profile(self):
+        with self.lock:
+            self.calls += 1
+            return self.every > 0 and self.calls % self.every == 0
+
+    def run(self, fn, *args, **kwargs):
+        if not self.should_profile():
+            return fn(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(fn, *args, **kwargs)
+        finally:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, f'grader-profile-{self.calls}.prof')
+            profiler.dump_stats(path)
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(self.top)
+            self.last_summary = {'call': self.calls, 'path': path, 'top': summary.getvalue()}
@@ -0,0 +1,137 @@
+"""
+Lexical diversity measures over a pre-tokenized word list.
+
+mtld() is bit-for-bit LexicalRichness(words, preprocessor=None,
+tokenizer=None).mtld(threshold), including its ZeroDivisionError on an empty
+list. LexicalDiversity keeps running state so words can be appended one at a
+time (streaming, batch) in O(1) each: term counts for TTR and HD-D, the
+forward MTLD factor state and the MATTR window. The backward MTLD pass has to
+start from the last word, so it is one walk over the stored words when mtld()
+is read.
+"""
+from collections import deque
+import math
+
+MTLD_THRESHOLD = 0.72
+MATTR_WINDOW = 100
+HDD_DRAWS = 42
+
+
+class MTLDPass:
+    """One direction of MTLD: factors of consecutive words whose TTR stays above threshold"""
+    __slots__ = ('threshold', 'terms', 'word_counter', 'factor_count', 'ttr')
+
+    def __init__(self, threshold=MTLD_THRESHOLD):
+        self.threshold = threshold
+        self.terms = set()
+        self.word_counter = 0
+        self.factor_count = 0
+        self.ttr = 0
+
+    def add(self, word):
+        self.word_counter += 1
+        self.terms.add(word)
+        self.ttr = len(self.terms) / self.word_counter
+        if self.ttr <= self.threshold:
+            self.word_counter = 0
+            self.terms = set()
+            self.factor_count += 1
+
+    def measure(self, words, terms):
+        """Text length per factor, for a text of `words` words and `terms` distinct terms"""
+        factor_count = self.factor_count
+        # Partial factor for the last segment: how far its TTR got from 1 towards the threshold
+        if self.word_counter > 0:
+            factor_count += (1 - self.ttr) / (1 - self.threshold)
+        # TTR never dropped to the threshold
+        if factor_count == 0:
+            ttr = terms / words
+            if ttr == 1:
+                factor_count += 1
+            else:
+                factor_count += (1 - ttr) / (1 - self.threshold)
+        return words / factor_count
+
+
+def mtld(words, threshold=MTLD_THRESHOLD):
+    forward = MTLDPass(threshold)
+    backward = MTLDPass(threshold)
+    for word in words:
+        forward.add(word)
+    for word in reversed(words):
+        backward.add(word)
+    terms = len(set(words))
+    return (forward.measure(len(words), terms) + backward.measure(len(words), terms)) / 2
+
+
+def hdd_contribution(words, frequency, draws):
+    """(1 - P(no occurrence in `draws` draws without replacement)) / draws"""
+    p_none = 1.0
+    for i in range(draws):
+        if words - frequency - i <= 0:
+            p_none = 0.0
+            break
+        p_none *= (words - frequency - i) / (words - i)
+    return (1 - p_none) / draws
+
+
+class LexicalDiversity:
+    def __init__(self, threshold=MTLD_THRESHOLD, window=MATTR_WINDOW, draws=HDD_DRAWS):
+        self.threshold = threshold
+        self.window = window
+        self.draws = draws
+        self.words = []
+        self.counts = {}
+        self.forward = MTLDPass(threshold)
+        self.recent = deque()
+        self.recent_counts = {}
+        self.window_ttr_sum = 0.0
+        self.windows = 0
+
+    def add(self, word):
+        self.words.append(word)
+        self.counts[word] = self.counts.get(word, 0) + 1
+        self.forward.add(word)
+
+        self.recent.append(word)
+        self.recent_counts[word] = self.recent_counts.get(word, 0) + 1
+        if len(self.recent) > self.window:
+            dropped = self.recent.popleft()
+            self.recent_counts[dropped] -= 1
+            if not self.recent_counts[dropped]:
+                del self.recent_counts[dropped]
+        if len(self.recent) == self.window:
+            self.window_ttr_sum += len(self.recent_counts) / self.window
+            self.windows += 1
+
+    def extend(self, words):
+        for word in words:
+            self.add(word)
+
+    def ttr(self):
+        return len(self.counts) / len(self.words) if self.words else None
+
+    def mtld(self):
+        """MTLD at the configured threshold, None without words"""
+        if not self.words:
+            return None
+        backward = MTLDPass(self.threshold)
+        for word in reversed(self.words):
+            backward.add(word)
+        words, terms = len(self.words), len(self.counts)
+        return (self.forward.measure(words, terms) + backward.measure(words, terms)) / 2
+
+    def mattr(self):
+        """Mean TTR over every window of `window` consecutive words, None for shorter texts"""
+        return self.window_ttr_sum / self.windows if self.windows else None
+
+    def hdd(self):
+        """HD-D with `draws` draws, None for texts shorter than that"""
+        if len(self.words) < self.draws:
+            return None
+        return math.fsum(hdd_contribution(len(self.words), frequency, self.draws) for frequency in self.counts.values())
+
+    def report(self, digits=3):
+        """Every measure, rounded, for feedback"""
+        measures = {'ttr': self.ttr(), 'mattr': self.mattr(), 'hdd': self.hdd()}
+        return {name: round(value, digits) if value is not None else None for name, value in measures.items()}
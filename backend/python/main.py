@@ -1,58 +1,617 @@
-from collections import defaultdict
-from sentence_transformers import SentenceTransformer, util
-import language_tool_python
-from lexicalrichness import LexicalRichness
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 import re
+import asyncio
+import bisect
+import contextvars
+import hashlib
+import importlib
+import itertools
 import json
+import os
+import signal
+import string
 import sys
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 
-# PRE-LOAD ALL MODELS AT MODULE LEVEL (only once)
-print("Loading models...", file=sys.stderr)
-SENTENCE_MODEL = SentenceTransformer('all-MiniLM-L6-v2')
-GRAMMAR_TOOL = language_tool_python.LanguageTool('en-US')
-SENTIMENT_ANALYZER = SentimentIntensityAnalyzer()
-print("Models loaded successfully!", file=sys.stderr)
+from embedding_backends import load_sentence_model
+from grammar_pool import GrammarPool, GrammarUnavailable
+from instrumentation import METRICS, SamplingProfiler, collect, timed
+from lexical_diversity import LexicalDiversity
+from result_cache import ResultCache, content_key
+from result_store import ResultStore
 
+_MODULE_START = time.perf_counter()
 
-def check_flow_order(text, model=None):
+
+# MODELS ARE LOADED LAZILY, ONCE, ON FIRST USE (or eagerly through warmup())
+def _load_sentence_model():
+    # Imported up front only so the startup report can separate import time from load time
+    importlib.import_module('sentence_transformers')
+    imported = time.perf_counter()
+    return load_sentence_model(SENTENCE_MODEL_NAME, EMBEDDING_BACKEND, EMBEDDING_THREADS), imported
+
+
+def _load_grammar_tool():
+    # As above; language_tool_python is only imported when a local server is started
+    importlib.import_module('requests')
+    imported = time.perf_counter()
+    urls = [url.strip() for url in os.environ.get('GRADER_GRAMMAR_URLS', '').split(',') if url.strip()]
+    pool = GrammarPool(
+        GRAMMAR_LANGUAGE,
+        size=int(os.environ.get('GRADER_GRAMMAR_POOL_SIZE', 1)),
+        urls=urls,
+        heap=os.environ.get('GRADER_GRAMMAR_HEAP'),
+        health_interval=float(os.environ.get('GRADER_GRAMMAR_HEALTH_INTERVAL', 30)),
+    )
+    return pool, imported
+
+
+def _load_sentiment_analyzer():
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    imported = time.perf_counter()
+    return SentimentIntensityAnalyzer(), imported
+
+
+def _load_keyword_grader():
+    imported = time.perf_counter()
+    return KeywordGrader(get_sentence_model()), imported
+
+
+def _load_flow_centroids():
+    imported = time.perf_counter()
+    return SectionCentroids(get_sentence_model()), imported
+
+
+RESOURCE_LOADERS = {
+    'sentence_model': _load_sentence_model,
+    'grammar_tool': _load_grammar_tool,
+    'sentiment_analyzer': _load_sentiment_analyzer,
+    'keyword_grader': _load_keyword_grader,
+    'flow_centroids': _load_flow_centroids,
+}
+
+# Resources that must be loaded (and timed) before another one
+RESOURCE_DEPENDENCIES = {
+    'keyword_grader': ['sentence_model'],
+    'flow_centroids': ['sentence_model'],
+}
+
+_resources = {}
+_resource_locks = {name: threading.Lock() for name in RESOURCE_LOADERS}
+
+# {resource: {'import': seconds, 'load': seconds}}
+LOAD_TIMES = {}
+
+
+def get_resource(name):
+    """Returns a loaded resource, loading it on first use (thread-safe)"""
+    resource = _resources.get(name)
+    if resource is not None:
+        return resource
+    
+    for dependency in RESOURCE_DEPENDENCIES.get(name, []):
+        get_resource(dependency)
+    
+    with _resource_locks[name]:
+        if name not in _resources:
+            print(f"Loading {name}...", file=sys.stderr)
+            start = time.perf_counter()
+            resource, imported = RESOURCE_LOADERS[name]()
+            end = time.perf_counter()
+            LOAD_TIMES[name] = {'import': round(imported - start, 4), 'load': round(end - imported, 4)}
+            _resources[name] = resource
+            print(f"Loaded {name} in {end - start:.2f}s", file=sys.stderr)
+    return _resources[name]
+
+
+def get_sentence_model():
+    return get_resource('sentence_model')
+
+
+def get_grammar_tool():
+    return get_resource('grammar_tool')
+
+
+def get_sentiment_analyzer():
+    return get_resource('sentiment_analyzer')
+
+
+def get_keyword_grader():
+    return get_resource('keyword_grader')
+
+
+def resources_for(criteria):
+    """Resources needed by the given (registered) criteria, in load order"""
+    names = []
+    for criterion in criteria:
+        entry = CRITERIA.get(criterion)
+        if entry is None:
+            continue
+        extra = entry.sentence_resources if SENTENCE_EMBEDDINGS else []
+        for name in entry.resources + extra:
+            for needed in RESOURCE_DEPENDENCIES.get(name, []) + [name]:
+                if needed not in names:
+                    names.append(needed)
+    return names
+
+
+def warmup(criteria=None):
+    """Eagerly loads everything the given criteria need (the whole rubric by default)"""
+    for name in rubric_plan(criteria).resources:
+        get_resource(name)
+    print("Models loaded successfully!", file=sys.stderr)
+
+
+def startup_report():
+    """Import and load time per loaded component, in seconds"""
+    return {
+        'module_import': MODULE_IMPORT_TIME,
+        'embedding_backend': EMBEDDING_BACKEND,
+        'components': dict(LOAD_TIMES),
+        'total': round(MODULE_IMPORT_TIME + sum(t['import'] + t['load'] for t in LOAD_TIMES.values()), 4)
+    }
+
+
+# Old module-level names still work for callers doing main.SENTENCE_MODEL etc.
+LAZY_GLOBALS = {
+    'SENTENCE_MODEL': 'sentence_model',
+    'GRAMMAR_TOOL': 'grammar_tool',
+    'SENTIMENT_ANALYZER': 'sentiment_analyzer',
+    'keyword_grader': 'keyword_grader',
+}
+
+
+SENTENCE_MODEL_NAME = 'all-MiniLM-L6-v2'
+# torch (fp32), int8 or onnx, see embedding_backends.py; threads = intra-op parallelism
+EMBEDDING_BACKEND = os.environ.get('GRADER_EMBEDDING_BACKEND', 'torch')
+EMBEDDING_THREADS = int(os.environ['GRADER_EMBEDDING_THREADS']) if os.environ.get('GRADER_EMBEDDING_THREADS') else None
+# GRADER_SENTENCE_EMBEDDINGS=1: encode every sentence once per submission; KeyWord takes the
+# best match over the text and its sentences, Flow classifies regex-less sentences by centroid
+SENTENCE_EMBEDDINGS = os.environ.get('GRADER_SENTENCE_EMBEDDINGS', '0') == '1'
+GRAMMAR_LANGUAGE = 'en-US'
+
+# Result cache, configured from the environment (see configure_cache)
+RESULT_CACHE = None
+_cache_fingerprint = None
+
+
+def configure_cache(max_entries=None, path=None, ttl=None, max_disk_entries=None):
     """
-    Checks if the text follows the correct flow order:
-    Salutation -> Name -> Mandatory -> Optional (if present) -> Closing
+    Enables the result cache. Defaults come from GRADER_CACHE_SIZE (in-memory
+    entries, 0 disables caching), GRADER_CACHE_PATH (SQLite file for the disk
+    tier), GRADER_CACHE_TTL (seconds) and GRADER_CACHE_DISK_SIZE.
     """
-    # Use pre-loaded model
-    flow_model = model if model is not None else SENTENCE_MODEL
-    
-    patterns = {
-        'salutation': [
-            r'\b(hi|hello|hey|greetings)\b',
-            r'\bhey there\b', r'\bhi there\b', r'\bhello there\b',
-            r'\bhi all\b', r'\bhey all\b', r'\bhi team\b', r'\bhello team\b', r'\bhey team\b',
-            r'\bhi everyone\b', r'\bhello everyone\b', r'\bhey everyone\b',
-            r'\bgood morning\b', r'\bgood afternoon\b', r'\bgood evening\b', r'\bgood day\b',
-            r'\bthrilled to\b', r'\bpleased to\b', r'\bexcited to\b',
-        ],
-        'name': [
-            r'\bmy name is\b', r'\bmyself\b', r'\bi am\b', r'\bi\'m\b', r'\bcalled\b',
-            r'\bi go by\b', r'\bpeople call me\b', r'\byou can call me\b',
-        ],
-        'mandatory': [
-            r'\byears old\b', r'\bage\b', r'\bold\b', r'\bschool\b', r'\bof class\b',
-            r'\bin grade\b', r'\bfamily\b', r'\bparents\b', r'\bmother\b', r'\bfather\b', r'\bsiblings\b',
-        ],
-        'optional': [
-            r'\bhobbies\b', r'\binterests\b', r'\blike to\b', r'\benjoy\b',
-            r'\bgoal\b', r'\bdream\b', r'\bambition\b',
-        ],
-        'closing': [
-            r'\bthank you\b', r'\bthanks\b', r'\bthat\'s all\b', r'\bthat\'s it\b', r'\bthat\'s me\b',
-        ]
-    }
+    global RESULT_CACHE
+    max_entries = max_entries if max_entries is not None else int(os.environ.get('GRADER_CACHE_SIZE', 1024))
+    path = path if path is not None else os.environ.get('GRADER_CACHE_PATH')
+    ttl = ttl if ttl is not None else (float(os.environ['GRADER_CACHE_TTL']) if os.environ.get('GRADER_CACHE_TTL') else None)
+    max_disk_entries = max_disk_entries if max_disk_entries is not None else int(os.environ.get('GRADER_CACHE_DISK_SIZE', 100000))
     
-    sentences = re.split(r'[.!?]+', text)
-    sentences = [s.strip() for s in sentences if s.strip() and len(s.strip()) > 5]
+    if RESULT_CACHE is not None:
+        RESULT_CACHE.close()
+    RESULT_CACHE = None
+    if max_entries > 0 or path:
+        RESULT_CACHE = ResultCache(max_entries, path, ttl, max_disk_entries)
+    return RESULT_CACHE
+
+
+# Result store, configured from GRADER_STORE_PATH (see configure_store)
+RESULT_STORE = None
+
+
+def configure_store(path=None):
+    """
+    Persists every graded result to the SQLite store at path (default:
+    GRADER_STORE_PATH; unset disables the store). Commit batching comes from
+    GRADER_STORE_BATCH (rows) and GRADER_STORE_FLUSH_INTERVAL (seconds).
+    """
+    global RESULT_STORE
+    path = path if path is not None else os.environ.get('GRADER_STORE_PATH')
+
+    if RESULT_STORE is not None:
+        RESULT_STORE.close()
+    RESULT_STORE = None
+    if path:
+        RESULT_STORE = ResultStore(
+            path,
+            batch_size=int(os.environ.get('GRADER_STORE_BATCH', 64)),
+            flush_interval=float(os.environ.get('GRADER_STORE_FLUSH_INTERVAL', 0.5)),
+        )
+    return RESULT_STORE
+
+
+def store_result(result, text, duration, submission_id=None):
+    """Queues a graded result for RESULT_STORE; a store failure never fails the request"""
+    if RESULT_STORE is None:
+        return
+    try:
+        RESULT_STORE.record(result, text, duration, submission_id)
+    except Exception as e:
+        print(f"Could not store result: {str(e)}", file=sys.stderr)
+
+
+# Modules whose source decides scores or feedback; edits to any of them invalidate cached results
+SCORING_MODULES = ['main.py', 'lexical_diversity.py', 'grammar_pool.py', 'embedding_backends.py']
+
+
+def cache_fingerprint():
+    """
+    Identity of everything a result depends on besides the input: the source of
+    SCORING_MODULES (rubric, thresholds, phrase lists, keyword categories, MTLD,
+    grammar and embedding backends) plus the model names, embedding and grammar
+    settings and installed library versions. Any change invalidates cached results.
+    """
+    global _cache_fingerprint
+    if _cache_fingerprint is None:
+        from importlib import metadata
+        
+        versions = {}
+        for package in ['sentence-transformers', 'torch', 'onnxruntime', 'optimum',
+                        'language-tool-python', 'vaderSentiment']:
+            try:
+                versions[package] = metadata.version(package)
+            except metadata.PackageNotFoundError:
+                versions[package] = None
+        source = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for module in SCORING_MODULES:
+            with open(os.path.join(directory, module), 'rb') as f:
+                source.update(f.read())
+        source = source.hexdigest()
+        _cache_fingerprint = content_key(
+            source, SENTENCE_MODEL_NAME, EMBEDDING_BACKEND, SENTENCE_EMBEDDINGS, GRAMMAR_LANGUAGE,
+            GRAMMAR_PER_SENTENCE, versions
+        )
+    return _cache_fingerprint
+
+
+def result_cache_key(text, duration, criteria=None):
+    """
+    The text is keyed exactly as submitted: whitespace or case changes can alter
+    grammar matches and feedback, so only identical submissions share a result.
+    Results graded on Error are also keyed by the LanguageTool servers' versions.
+    """
+    grammar = None
+    if criteria is None or 'Error' in criteria:
+        try:
+            grammar = get_grammar_tool().identity()
+        except Exception:
+            # Error is graded as unavailable, and degraded results are not cached
+            pass
+    return content_key(
+        cache_fingerprint(), grammar, text, float(duration), sorted(criteria) if criteria is not None else None
+    )
+
+
+def __getattr__(name):
+    if name in LAZY_GLOBALS:
+        return get_resource(LAZY_GLOBALS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class PhraseMatcher:
+    """
+    Finds every occurrence of a fixed set of phrases in a single regex scan.
+    Phrases are tried longest-first inside a lookahead so overlapping matches
+    are kept, and shorter phrases that are prefixes of the longest match at a
+    position are reported there as well (same result as one `in` test per phrase).
+    """
+    def __init__(self, phrases):
+        self.phrases = list(dict.fromkeys(phrase.lower() for phrase in phrases))
+        longest_first = sorted(self.phrases, key=len, reverse=True)
+        self.pattern = re.compile('(?=(' + '|'.join(re.escape(p) for p in longest_first) + '))')
+        self.prefixes = {p: [q for q in self.phrases if p.startswith(q)] for p in self.phrases}
     
-    if len(sentences) < 3:
+    def scan(self, lowered):
+        """Returns {phrase: [start positions]} for every phrase found in already-lowercased text"""
+        positions = {}
+        for match in self.pattern.finditer(lowered):
+            for phrase in self.prefixes[match.group(1)]:
+                positions.setdefault(phrase, []).append(match.start())
+        return positions
+
+
+SALUTATION_LEVELS = [
+    # (level, score, phrases) - a higher level found later overrides a lower one
+    ("Basic", 2, ["Hi", "Hello", "Hey", "Hey there", "Hi there", "Hello there",
+                  "Hi all", "Hey all", "Hi team", "Hello team", "Hey team",
+                  "Greetings", "Hi everyone"]),
+    ("Mid-level", 4, ["Good Morning", "Good Afternoon", "Good Evening", "Good Day",
+                      "Good morning everyone", "Good afternoon everyone", "Good evening everyone",
+                      "A very good day to you all", "Ladies and gentlemen, hello",
+                      "Dear team, hello", "Dear all, hello", "Warm greetings everyone",
+                      "Hello everyone", "hi everyone", "hey everyone"]),
+    ("Strong", 5, ["thrilled to", 'Pleased to', "Excited to", "I am excited to introduce myself",
+                   "Feeling great to be here", "I'm so excited to be here today"]),
+]
+
+FILLER_WORDS = ["um", "uh", "like", "you know", "so", "actually", "basically",
+                "right", "i mean", "well", "kinda", "sort of", "okay", "hmm", "ah"]
+
+# Sections in priority order: a sentence belongs to the first section with a matching pattern
+FLOW_PATTERNS = {
+    'salutation': [
+        r'\b(?:hi|hello|hey|greetings)\b',
+        r'\bhey there\b', r'\bhi there\b', r'\bhello there\b',
+        r'\bhi all\b', r'\bhey all\b', r'\bhi team\b', r'\bhello team\b', r'\bhey team\b',
+        r'\bhi everyone\b', r'\bhello everyone\b', r'\bhey everyone\b',
+        r'\bgood morning\b', r'\bgood afternoon\b', r'\bgood evening\b', r'\bgood day\b',
+        r'\bthrilled to\b', r'\bpleased to\b', r'\bexcited to\b',
+    ],
+    'name': [
+        r'\bmy name is\b', r'\bmyself\b', r'\bi am\b', r'\bi\'m\b', r'\bcalled\b',
+        r'\bi go by\b', r'\bpeople call me\b', r'\byou can call me\b',
+    ],
+    'mandatory': [
+        r'\byears old\b', r'\bage\b', r'\bold\b', r'\bschool\b', r'\bof class\b',
+        r'\bin grade\b', r'\bfamily\b', r'\bparents\b', r'\bmother\b', r'\bfather\b', r'\bsiblings\b',
+    ],
+    'optional': [
+        r'\bhobbies\b', r'\binterests\b', r'\blike to\b', r'\benjoy\b',
+        r'\bgoal\b', r'\bdream\b', r'\bambition\b',
+    ],
+    'closing': [
+        r'\bthank you\b', r'\bthanks\b', r'\bthat\'s all\b', r'\bthat\'s it\b', r'\bthat\'s me\b',
+    ]
+}
+FLOW_SECTIONS = list(FLOW_PATTERNS.keys())
+# One lookahead alternation over all sections, in priority order: at each position the
+# named group that matches is the highest-priority section starting there
+FLOW_MATCHER = re.compile(
+    r'\b(?=' + '|'.join(f"(?P<{section}>{'|'.join(patterns)})" for section, patterns in FLOW_PATTERNS.items()) + ')'
+)
+SENTENCE_DELIMITER = re.compile(r'[.!?]+')
+
+SALUTATION_MATCHER = PhraseMatcher([phrase for _, _, phrases in SALUTATION_LEVELS for phrase in phrases])
+FILLER_MATCHER = PhraseMatcher(FILLER_WORDS)
+
+
+WORD_TOKEN = re.compile(r'\b\w+\b')
+# LexicalRichness' default preprocess + tokenize as one table: digits and dashes
+# are dropped, every other ASCII punctuation character becomes a space
+LEXICAL_TRANSLATION = str.maketrans(
+    {**{digit: None for digit in '0123456789'}, '\u2013': None, '\u2014': None, '-': None,
+     **{p: ' ' for p in string.punctuation if p != '-'}}
+)
+
+
+class Document:
+    """
+    One submission's text, preprocessed once and shared by every criterion.
+    Each view is derived on first use and kept for the rest of the request.
+    """
+    __slots__ = ('text', 'lowered', '_words', '_tokens', '_sentences', '_sections', '_lexical_tokens',
+                 '_embeddings', '_embedding_lock')
+
+    def __init__(self, text):
+        self.text = text
+        self.lowered = text.lower()
+        self._words = None
+        self._tokens = None
+        self._sentences = None
+        self._sections = None
+        self._lexical_tokens = None
+        self._embeddings = None
+        self._embedding_lock = threading.Lock()
+
+    @property
+    def words(self):
+        """Whitespace-separated words, as text.split()"""
+        if self._words is None:
+            self._words = self.text.split()
+        return self._words
+
+    @property
+    def word_count(self):
+        return len(self.words)
+
+    @property
+    def tokens(self):
+        """Lowercased \\w+ tokens"""
+        if self._tokens is None:
+            self._tokens = WORD_TOKEN.findall(self.lowered)
+        return self._tokens
+
+    @property
+    def sentences(self):
+        """Sentences longer than 5 characters, as classify_sentences returns them"""
+        if self._sentences is None:
+            self._sentences, self._sections = classify_sentences(self.text, self.lowered)
+        return self._sentences
+
+    @property
+    def sections(self):
+        """Flow section of each sentence, or None"""
+        if self._sections is None:
+            self._sentences, self._sections = classify_sentences(self.text, self.lowered)
+        return self._sections
+
+    @property
+    def lexical_tokens(self):
+        """The word list LexicalRichness' default tokenizer builds, used for lexical diversity"""
+        if self._lexical_tokens is None:
+            self._lexical_tokens = self.lowered.translate(LEXICAL_TRANSLATION).split()
+        return self._lexical_tokens
+
+    def embeddings(self):
+        """
+        Normalized embeddings of the whole text (row 0) and of each sentence
+        (row i + 1), from one batched encode shared by KeyWord and Flow
+        """
+        with self._embedding_lock:
+            if self._embeddings is None:
+                with timed('step.sentence_encode'):
+                    self._embeddings = get_sentence_model().encode(
+                        [self.lowered] + [sentence.lower() for sentence in self.sentences],
+                        convert_to_tensor=True, normalize_embeddings=True
+                    )
+        return self._embeddings
+
+
+def find_salutation(lowered):
+    """Returns (score, found_salutation, level) for already-lowercased text"""
+    return rank_salutation(SALUTATION_MATCHER.scan(lowered))
+
+
+def rank_salutation(found):
+    """(score, found_salutation, level) from the set of lowercased salutation phrases present"""
+    score, found_salutation, salutation_level = 0, None, "None"
+    for level, level_score, phrases in SALUTATION_LEVELS:
+        for txt in phrases:
+            if txt.lower() in found:
+                score, found_salutation, salutation_level = level_score, txt, level
+                break
+    return score, found_salutation, salutation_level
+
+
+def find_fillers(lowered):
+    """Returns the filler words present in already-lowercased text, in FILLER_WORDS order"""
+    found = FILLER_MATCHER.scan(lowered)
+    return [word for word in FILLER_WORDS if word in found]
+
+
+def classify_sentences(text, lowered=None):
+    """
+    Splits text into sentences like re.split(r'[.!?]+') and classifies all of them
+    with one scan of the lowercased text. Returns (sentences, sections) where
+    sections[i] is the flow section of sentences[i] or None.
+    """
+    lowered = text.lower() if lowered is None else lowered
+    segments = []
+    position = 0
+    for delimiter in SENTENCE_DELIMITER.finditer(lowered):
+        segments.append((position, delimiter.start()))
+        position = delimiter.end()
+    segments.append((position, len(lowered)))
+    
+    # lower() can change the length of a few characters; keep the length filter on the original text
+    if len(lowered) == len(text):
+        originals = [text[start:end] for start, end in segments]
+    else:
+        originals = SENTENCE_DELIMITER.split(text)
+    
+    sentences = []
+    segment_sentence = []
+    for (start, end), original in zip(segments, originals):
+        stripped = original.strip()
+        if stripped and len(stripped) > 5:
+            segment_sentence.append(len(sentences))
+            sentences.append(stripped)
+        else:
+            segment_sentence.append(None)
+    
+    priority = {section: i for i, section in enumerate(FLOW_SECTIONS)}
+    best = [None] * len(sentences)
+    segment_starts = [start for start, _ in segments]
+    for match in FLOW_MATCHER.finditer(lowered):
+        sentence_index = segment_sentence[bisect.bisect_right(segment_starts, match.start()) - 1]
+        if sentence_index is None:
+            continue
+        section = match.lastgroup
+        if best[sentence_index] is None or priority[section] < priority[best[sentence_index]]:
+            best[sentence_index] = section
+    
+    return sentences, best
+
+
+def check_flow_order(text, model=None, semantic=None):
+    """
+    Checks if the text follows the correct flow order:
+    Salutation -> Name -> Mandatory -> Optional (if present) -> Closing
+    With semantic (default: SENTENCE_EMBEDDINGS, like the Flow criterion),
+    sentences no pattern matches are assigned to the nearest section centroid
+    (see SectionCentroids) of model, by default the shared sentence model.
+    Without it, model is not used.
+    """
+    doc = Document(text)
+    semantic = SENTENCE_EMBEDDINGS if semantic is None else semantic
+    if not semantic or model is None or model is _resources.get('sentence_model'):
+        return document_flow_order(doc, semantic)
+    sections = doc.sections
+    if doc.sentences and None in sections:
+        embeddings = model.encode([s.lower() for s in doc.sentences], convert_to_tensor=True, normalize_embeddings=True)
+        sections = model_centroids(model).fill(sections, embeddings)
+    return flow_order_result(len(doc.sentences), first_sections(sections))
+
+
+def document_flow_order(doc, semantic=False):
+    sections = doc.sections
+    if semantic and doc.sentences and None in sections:
+        # Row 0 of the shared embeddings is the whole text
+        sections = get_resource('flow_centroids').fill(sections, doc.embeddings()[1:])
+    return flow_order_result(len(doc.sentences), first_sections(sections))
+
+
+# Example sentences per flow section; their mean embedding is the section centroid
+FLOW_EXEMPLARS = {
+    'salutation': ["Hello everyone", "Good morning to all of you", "Hi, it is nice to meet you all",
+                   "Greetings to everyone here"],
+    'name': ["My name is Asha", "I am Ravi", "People call me Kabir", "Myself Meera"],
+    'mandatory': ["I am thirteen years old", "I study in class eight at Green Valley School",
+                  "I live with my parents and my younger sister", "There are four members in my family"],
+    'optional': ["My hobbies are reading and painting", "In my free time I play cricket",
+                 "My dream is to become a doctor", "One interesting fact about me is that I can juggle"],
+    'closing': ["Thank you for listening", "That is all about me", "Thanks for your time",
+                "It was nice talking to you"],
+}
+# Minimum cosine similarity to a centroid for a sentence to be assigned its section
+FLOW_CENTROID_THRESHOLD = 0.35
+
+
+# SectionCentroids of models other than the shared one, built once per model
+_model_centroids = weakref.WeakKeyDictionary()
+_model_centroids_lock = threading.Lock()
+
+
+def model_centroids(model):
+    with _model_centroids_lock:
+        centroids = _model_centroids.get(model)
+        if centroids is None:
+            centroids = _model_centroids[model] = SectionCentroids(model)
+    return centroids
+
+
+class SectionCentroids:
+    def __init__(self, model):
+        import torch
+        
+        self.sections = list(FLOW_EXEMPLARS)
+        centroids = []
+        for section in self.sections:
+            embeddings = model.encode(
+                [sentence.lower() for sentence in FLOW_EXEMPLARS[section]],
+                convert_to_tensor=True, normalize_embeddings=True
+            )
+            centroid = embeddings.mean(0)
+            centroids.append(centroid / centroid.norm())
+        self.matrix = torch.stack(centroids)
+
+    def fill(self, sections, embeddings, threshold=FLOW_CENTROID_THRESHOLD):
+        """sections with each None replaced by the nearest centroid's section (if close enough)"""
+        similarities = (embeddings @ self.matrix.T).tolist()
+        filled = list(sections)
+        for i, section in enumerate(sections):
+            if section is None:
+                best = max(range(len(self.sections)), key=lambda j: similarities[i][j])
+                if similarities[i][best] >= threshold:
+                    filled[i] = self.sections[best]
+        return filled
+
+
+def first_sections(sections, offset=0, found=None):
+    """{section: index of its first sentence}, in order of first appearance"""
+    found = {} if found is None else found
+    for i, section in enumerate(sections):
+        if section and section not in found:
+            found[section] = offset + i
+    return found
+
+
+def flow_order_result(sentence_count, found_sections):
+    """check_flow_order's verdict from the sentence count and first_sections()"""
+    if sentence_count < 3:
         return {
             'is_correct': False,
             'found_sections': [],
@@ -60,24 +619,7 @@ def check_flow_order(text, model=None):
             'issue': 'Introduction too short (less than 3 sentences)'
         }
     
-    sentence_sections = []
-    
-    for i, sentence in enumerate(sentences):
-        sentence_lower = sentence.lower()
-        matched_section = None
-        
-        for section, pattern_list in patterns.items():
-            for pattern in pattern_list:
-                if re.search(pattern, sentence_lower):
-                    matched_section = section
-                    break
-            if matched_section:
-                break
-        
-        if matched_section:
-            sentence_sections.append({'index': i, 'section': matched_section, 'sentence': sentence})
-    
-    if not sentence_sections:
+    if not found_sections:
         return {
             'is_correct': False,
             'found_sections': [],
@@ -85,12 +627,6 @@ def check_flow_order(text, model=None):
             'issue': 'No recognizable sections found'
         }
     
-    found_sections = {}
-    for item in sentence_sections:
-        section = item['section']
-        if section not in found_sections:
-            found_sections[section] = item['index']
-    
     required = ['salutation', 'name', 'mandatory', 'closing']
     missing = [s for s in required if s not in found_sections]
     
@@ -134,15 +670,19 @@ def check_flow_order(text, model=None):
     }
 
 
+def find_positive_words(tokens):
+    """The lowercased tokens with a positive VADER lexicon score"""
+    lexicon = get_sentiment_analyzer().lexicon
+    return [word for word in tokens if lexicon.get(word, 0) > 0]
+
+
 def calculate_positive_word_probability(text):
-    words = re.findall(r'\b\w+\b', text.lower())
-    total_words = len(words) if words else 1  
-    
-    positive_words = []
-    for word in words:
-        word_score = SENTIMENT_ANALYZER.lexicon.get(word, 0)
-        if word_score > 0:
-            positive_words.append(word)
+    return positive_word_probability(Document(text))
+
+
+def positive_word_probability(doc):
+    positive_words = find_positive_words(doc.tokens)
+    total_words = len(doc.tokens) if doc.tokens else 1  
     
     positive_word_count = len(positive_words)
     positive_word_probability = positive_word_count / total_words
@@ -150,28 +690,123 @@ def calculate_positive_word_probability(text):
     return round(positive_word_probability, 4), positive_words
 
 
+# Per-sentence checking, configured from GRADER_GRAMMAR_PER_SENTENCE. Off by default:
+# rules that span sentences (e.g. three sentences starting with the same word) never
+# fire on a single sentence and contexts stop at sentence ends, so counts and feedback
+# differ from the whole-text check the scores are defined by.
+GRAMMAR_PER_SENTENCE = os.environ.get('GRADER_GRAMMAR_PER_SENTENCE', '0') == '1'
+# A sentence ends at delimiters followed by whitespace, except after these abbreviations
+GRAMMAR_SENTENCE_END = re.compile(r'[.!?]+\s+')
+GRAMMAR_ABBREVIATIONS = re.compile(r'(?:^|\W)(?:mr|mrs|ms|dr|st|prof|sr|jr|vs|no|mt)\.$', re.IGNORECASE)
+
+# LanguageTool matches per checked text, configured from GRADER_GRAMMAR_CACHE_SIZE (0 disables)
+_grammar_cache_size = int(os.environ.get('GRADER_GRAMMAR_CACHE_SIZE', 4096))
+GRAMMAR_CACHE = ResultCache(_grammar_cache_size) if _grammar_cache_size > 0 else None
+_grammar_pool = None
+_grammar_pool_lock = threading.Lock()
+
+
+def get_grammar_pool():
+    global _grammar_pool
+    if _grammar_pool is None:
+        with _grammar_pool_lock:
+            if _grammar_pool is None:
+                # Separate from the criterion pool: Error waits on these tasks from a criterion thread
+                workers = int(os.environ.get('GRADER_GRAMMAR_THREADS', 4))
+                _grammar_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='grammar')
+    return _grammar_pool
+
+
+def split_grammar_pieces(text):
+    """Returns [(start, piece)] covering text exactly, one sentence per piece"""
+    pieces = []
+    start = 0
+    for end in GRAMMAR_SENTENCE_END.finditer(text):
+        if GRAMMAR_ABBREVIATIONS.search(text, start, end.start() + 1):
+            continue
+        pieces.append((start, text[start:end.end()]))
+        start = end.end()
+    if start < len(text):
+        pieces.append((start, text[start:]))
+    return pieces
+
+
+def check_piece(piece):
+    """LanguageTool matches for one piece as dicts with piece-relative offsets"""
+    return [
+        dict(match, replacements=match['replacements'][:3])
+        for match in get_grammar_tool().check(piece)
+    ]
+
+
+def grammar_cache_key(piece):
+    """Matches depend on the server's rules as much as on our code"""
+    return content_key(cache_fingerprint(), get_grammar_tool().identity(), piece)
+
+
+def check_grammar(text, per_sentence=None):
+    """
+    LanguageTool matches for text, in text order with absolute offsets,
+    served from GRAMMAR_CACHE when the same text was checked before.
+    per_sentence (default GRAMMAR_PER_SENTENCE) checks each sentence on its
+    own instead, concurrently and cached per sentence; see
+    GRAMMAR_PER_SENTENCE for how that differs from the whole-text check.
+    """
+    per_sentence = GRAMMAR_PER_SENTENCE if per_sentence is None else per_sentence
+    pieces = split_grammar_pieces(text) if per_sentence else [(0, text)]
+    found = [None] * len(pieces)
+    keys = [None] * len(pieces)
+    
+    if GRAMMAR_CACHE is not None:
+        for i, (_, piece) in enumerate(pieces):
+            keys[i] = grammar_cache_key(piece)
+            found[i] = GRAMMAR_CACHE.get(keys[i])
+    
+    missing = [i for i, matches in enumerate(found) if matches is None]
+    if missing:
+        with timed('step.grammar_check'):
+            if len(missing) == 1:
+                found[missing[0]] = check_piece(pieces[missing[0]][1])
+            else:
+                checked = get_grammar_pool().map(check_piece, [pieces[i][1] for i in missing])
+                for i, matches in zip(missing, checked):
+                    found[i] = matches
+        if GRAMMAR_CACHE is not None:
+            for i in missing:
+                GRAMMAR_CACHE.put(keys[i], found[i])
+    
+    matches = []
+    for (start, _), piece_matches in zip(pieces, found):
+        for match in piece_matches:
+            matches.append(dict(match, offset=start + match['offset']))
+    return matches
+
+
 def get_grammar_error_count(text):
+    """Returns (error count, first five errors); raises GrammarUnavailable when text could not be checked"""
     try:
-        matches = GRAMMAR_TOOL.check(text)
-        error_details = []
-        
-        for match in matches[:5]:
-            error_details.append({
-                'message': match.message,
-                'context': match.context,
-                'suggestions': match.replacements[:3] if match.replacements else []
-            })
-        
-        return len(matches), error_details
+        matches = check_grammar(text)
     except Exception as e:
         print(f"Grammar check error: {e}", file=sys.stderr)
-        return 0, []
+        METRICS.increment('grammar_unavailable')
+        if isinstance(e, GrammarUnavailable):
+            raise
+        raise GrammarUnavailable(str(e)) from e
+    
+    error_details = []
+    for match in matches[:5]:
+        error_details.append({
+            'message': match['message'],
+            'context': match['context'],
+            'suggestions': match['replacements']
+        })
+    
+    return len(matches), error_details
 
 
 class KeywordGrader:
-    def __init__(self):
-        # Use pre-loaded model
-        self.model = SENTENCE_MODEL
+    def __init__(self, model=None):
+        self.model = model if model is not None else get_sentence_model()
         
         self.keyword_categories = {
             "name": {"weight": 4, "keywords": ["name", "called", "myself", "I am"]},
@@ -184,38 +819,84 @@ class KeywordGrader:
             "unique_fact": {"weight": 2, "keywords": ["unique", "fun fact", "interesting", "special", "people don't know"]},
             "strengths": {"weight": 2, "keywords": ["strength", "achievement", "good at", "skill", "improve"]}
         }
+        self.build_keyword_matrix()
+    
+    def build_keyword_matrix(self):
+        """
+        Encodes every keyword of every category once into a single normalized
+        matrix. category_offsets maps category -> (start, end) rows.
+        """
+        self.keyword_phrases = []
+        self.category_offsets = {}
+        for category, details in self.keyword_categories.items():
+            start = len(self.keyword_phrases)
+            self.keyword_phrases.extend(details["keywords"])
+            self.category_offsets[category] = (start, len(self.keyword_phrases))
+        
+        self.keyword_matrix = self.model.encode(
+            [keyword.lower() for keyword in self.keyword_phrases],
+            convert_to_tensor=True, normalize_embeddings=True
+        )
+    
+    def encode_text(self, text):
+        return self.encode_lowered(text.lower())
+    
+    def encode_lowered(self, lowered):
+        with timed('step.text_encode'):
+            return self.model.encode(lowered, convert_to_tensor=True, normalize_embeddings=True)
     
     def semantic_similarity(self, text, keywords, threshold=0.2):
-        text_embedding = self.model.encode(text.lower(), convert_to_tensor=True)
+        text_embedding = self.encode_text(text)
+        keyword_embeddings = self.model.encode(
+            [keyword.lower() for keyword in keywords],
+            convert_to_tensor=True, normalize_embeddings=True
+        )
+        similarities = (keyword_embeddings @ text_embedding).tolist()
         
         max_similarity = 0
         best_keyword = None
         
-        for keyword in keywords:
-            keyword_embedding = self.model.encode(keyword.lower(), convert_to_tensor=True)
-            similarity = util.pytorch_cos_sim(text_embedding, keyword_embedding).item()
-            
+        for keyword, similarity in zip(keywords, similarities):
             if similarity > max_similarity:
                 max_similarity = similarity
                 best_keyword = keyword
         
         return max_similarity >= threshold, max_similarity, best_keyword
     
-    def calculate_keyword_score(self, text):
+    def score_embedding(self, text_embedding, threshold=0.2):
+        """Scores all categories from one normalized text embedding with a single matrix multiply"""
+        with timed('step.keyword_matrix'):
+            similarities = (self.keyword_matrix @ text_embedding).tolist()
+        return self.score_similarities(similarities, threshold)
+    
+    def score_embeddings(self, embeddings, threshold=0.2):
+        """Scores all categories by each keyword's best similarity over several normalized embeddings"""
+        with timed('step.keyword_matrix'):
+            similarities = (self.keyword_matrix @ embeddings.T).max(1).values.tolist()
+        return self.score_similarities(similarities, threshold)
+    
+    def score_similarities(self, similarities, threshold=0.2):
+        """(score, matches, missing) from one similarity per row of keyword_matrix"""
         total_score = 0
         matches_found = []
         missing_categories = []
         
         for category, details in self.keyword_categories.items():
-            is_match, similarity_score, best_keyword = self.semantic_similarity(
-                text, details["keywords"]
-            )
+            start, end = self.category_offsets[category]
             
-            if is_match:
+            # Same tie-breaking as a linear scan: first keyword with the highest positive similarity
+            max_similarity = 0
+            best_keyword = None
+            for index in range(start, end):
+                if similarities[index] > max_similarity:
+                    max_similarity = similarities[index]
+                    best_keyword = self.keyword_phrases[index]
+            
+            if max_similarity >= threshold:
                 total_score += details["weight"]
                 matches_found.append({
                     "category": category,
-                    "similarity": round(similarity_score, 3),
+                    "similarity": round(max_similarity, 3),
                     "points": details["weight"],
                     "matched_keyword": best_keyword
                 })
@@ -227,329 +908,996 @@ class KeywordGrader:
                 })
         
         return total_score, matches_found, missing_categories
+    
+    def calculate_keyword_score(self, text):
+        return self.score_embedding(self.encode_text(text))
 
 
-# Initialize keyword grader once
-keyword_grader = KeywordGrader()
+def salutation_result(score, found_salutation, salutation_level):
+    feedback = {
+        'found': found_salutation,
+        'level': salutation_level,
+        'suggestion': 'Try using more enthusiastic greetings like "I\'m thrilled to introduce myself"' if score < 4 else 'Excellent greeting!'
+    }
+    return score, feedback
 
 
-def grade(text, gradingCriterion, subCriterion, weights, duration):
-    scores = defaultdict(int)
-    detailed_feedback = {}
+def salutation_criterion(doc, duration, max_score, text_embedding=None):
+    return salutation_result(*find_salutation(doc.lowered))
 
-    for criteria in weights.keys():
-        max_score = weights[criteria]
-        score = 0
-        feedback = {}
 
-        if criteria == 'Salutation':
-            basic = ["Hi", "Hello", "Hey", "Hey there", "Hi there", "Hello there", 
-                    "Hi all", "Hey all", "Hi team", "Hello team", "Hey team", 
-                    "Greetings", "Hi everyone"]
-            mid = ["Good Morning", "Good Afternoon", "Good Evening", "Good Day",
-                  "Good morning everyone", "Good afternoon everyone", "Good evening everyone",
-                  "A very good day to you all", "Ladies and gentlemen, hello",
-                  "Dear team, hello", "Dear all, hello", "Warm greetings everyone", 
-                  "Hello everyone", "hi everyone", "hey everyone"]
-            strong = ["thrilled to", 'Pleased to', "Excited to", "I am excited to introduce myself",
-                     "Feeling great to be here", "I'm so excited to be here today"]
-            
-            found_salutation = None
-            salutation_level = "None"
-            
-            for txt in basic:
-                if txt.lower() in text.lower():
-                    score = 2
-                    found_salutation = txt
-                    salutation_level = "Basic"
-                    break
-
-            for txt in mid:
-                if txt.lower() in text.lower():
-                    score = 4
-                    found_salutation = txt
-                    salutation_level = "Mid-level"
-                    break
-                    
-            for txt in strong:
-                if txt.lower() in text.lower():
-                    score = 5
-                    found_salutation = txt
-                    salutation_level = "Strong"
-                    break
-
-            scores[criteria] = score
-            feedback = {
-                'found': found_salutation,
-                'level': salutation_level,
-                'suggestion': 'Try using more enthusiastic greetings like "I\'m thrilled to introduce myself"' if score < 4 else 'Excellent greeting!'
-            }
-        
-        elif criteria == 'KeyWord':
-            keyword_score, matches, missing = keyword_grader.calculate_keyword_score(text)
-            scores[criteria] = min(keyword_score, weights[criteria])
-            feedback = {
-                'matched_categories': matches,
-                'missing_categories': missing,
-                'coverage': f"{len(matches)}/{len(keyword_grader.keyword_categories)} categories covered"
-            }
-
-        elif criteria == 'SpeechRate':
-            words = text.split()
-            rate = len(words)/(duration/60)
-            
-            if 111 <= rate <= 140:
-                score = 10
-                rating = "Optimal"
-                suggestion = "Perfect speech rate!"
-            elif 141 <= rate <= 160:
-                score = 6
-                rating = "Slightly fast"
-                suggestion = "Consider slowing down slightly for better clarity"
-            elif 81 <= rate <= 110:
-                score = 6
-                rating = "Slightly slow"
-                suggestion = "Try speaking a bit faster to maintain engagement"
-            else:
-                score = 2
-                rating = "Too fast" if rate > 160 else "Too slow"
-                suggestion = "Adjust your speech pace significantly (aim for 110-140 wpm)"
-
-            scores[criteria] = score
-            feedback = {
-                'rate': round(rate, 2),
-                'rating': rating,
-                'optimal_range': '111-140 wpm',
-                'suggestion': suggestion
-            }
-
-        elif criteria == 'Error':
-            count, error_details = get_grammar_error_count(text)
-            words = len(text.split())
-            err = 1 - min((count/words)*10, 1)
-            
-            if err >= 0.9:
-                score = 10
-                rating = "Excellent"
-            elif 0.7 <= err <= 0.899999999999:
-                score = 8
-                rating = "Very Good"
-            elif 0.5 <= err <= 0.699999999:
-                score = 6
-                rating = "Good"
-            elif 0.3 <= err <= 0.4999999:
-                score = 4
-                rating = "Fair"
-            else:
-                score = 2
-                rating = "Needs Improvement"
-
-            scores[criteria] = score
-            feedback = {
-                'error_count': count,
-                'error_rate': round((count/words)*100, 2),
-                'rating': rating,
-                'sample_errors': error_details,
-                'suggestion': f'Found {count} grammatical issues' if count > 0 else 'No grammatical errors detected!'
-            }
-
-        elif criteria == "Richness":
-            lex = LexicalRichness(text)
-            mtld_score = lex.mtld()/100
-            
-            if 0.9 <= mtld_score <= 1.0:
-                score = 10
-                rating = "Excellent"
-            elif 0.7 <= mtld_score <= 0.89999999999:
-                score = 8
-                rating = "Very Good"
-            elif 0.5 <= mtld_score <= 0.6999999999999999:
-                score = 6
-                rating = "Good"
-            elif 0.3 <= mtld_score <= 0.4999999999999999:
-                score = 4
-                rating = "Fair"
-            else:
-                score = 2
-                rating = "Needs Improvement"
-
-            scores[criteria] = score
-            feedback = {
-                'mtld_score': round(mtld_score, 3),
-                'rating': rating,
-                'suggestion': 'Try using more varied vocabulary' if score < 8 else 'Excellent vocabulary diversity!'
-            }
-
-        elif criteria == 'FillerWordRate':
-            filler_words = ["um", "uh", "like", "you know", "so", "actually", "basically", 
-                          "right", "i mean", "well", "kinda", "sort of", "okay", "hmm", "ah"]
-            found_fillers = []
-            
-            for word in filler_words:
-                if word.lower() in text.lower():
-                    found_fillers.append(word)
+def keyword_criterion(doc, duration, max_score, text_embedding=None):
+    keyword_grader = get_keyword_grader()
+    if SENTENCE_EMBEDDINGS:
+        keyword_score, matches, missing = keyword_grader.score_embeddings(doc.embeddings())
+    else:
+        if text_embedding is None:
+            text_embedding = keyword_grader.encode_lowered(doc.lowered)
+        keyword_score, matches, missing = keyword_grader.score_embedding(text_embedding)
+    return keyword_result(keyword_grader, keyword_score, matches, missing, max_score)
 
-            filler_count = len(found_fillers)
-            fwr = filler_count/len(text.split())*100
-            
-            if 0 <= fwr <= 3:
-                score = 15
-                rating = "Excellent"
-            elif 4 <= fwr <= 6:
-                score = 12
-                rating = "Very Good"
-            elif 7 <= fwr <= 9:
-                score = 9
-                rating = "Good"
-            elif 10 <= fwr <= 12:
-                score = 6
-                rating = "Fair"
-            else:
-                score = 3
-                rating = "Needs Improvement"
-
-            scores[criteria] = score
-            feedback = {
-                'filler_count': filler_count,
-                'filler_rate': round(fwr, 2),
-                'found_fillers': found_fillers,
-                'rating': rating,
-                'suggestion': f'Reduce filler words: {", ".join(found_fillers[:3])}' if found_fillers else 'Great clarity!'
-            }
-
-        elif criteria == 'Sentiment':
-            prob, positive_words = calculate_positive_word_probability(text)
-
-            if prob >= 0.999999999999:
-                score = 15
-                rating = "Excellent"
-            elif 0.7 <= prob <= 0.8999999999999:
-                score = 12
-                rating = "Very Good"
-            elif 0.5 <= prob <= 0.6999999999999:
-                score = 9
-                rating = "Good"
-            elif 0.3 <= prob <= 0.4999999999999:
-                score = 6
-                rating = "Fair"
-            else:
-                score = 3
-                rating = "Needs Improvement"
-
-            scores[criteria] = score
-            feedback = {
-                'positivity_score': prob,
-                'positive_words': positive_words[:10],
-                'rating': rating,
-                'suggestion': 'Add more positive and engaging words' if score < 12 else 'Great positive tone!'
-            }
-
-        elif criteria == 'Flow':
-            flow_result = check_flow_order(text, SENTENCE_MODEL)
-            if flow_result['is_correct']:
-                scores[criteria] = 5
-            else:
-                scores[criteria] = 0
-            
-            feedback = {
-                'is_correct': flow_result['is_correct'],
-                'found_sections': flow_result['found_sections'],
-                'missing_sections': flow_result['missing_sections'],
-                'issue': flow_result['issue'],
-                'suggestion': flow_result['issue'] if not flow_result['is_correct'] else 'Perfect flow structure!'
-            }
-        
-        detailed_feedback[criteria] = feedback
+
+def keyword_result(keyword_grader, keyword_score, matches, missing, max_score):
+    feedback = {
+        'matched_categories': matches,
+        'missing_categories': missing,
+        'coverage': f"{len(matches)}/{len(keyword_grader.keyword_categories)} categories covered"
+    }
+    return min(keyword_score, max_score), feedback
+
+
+def speech_rate_criterion(doc, duration, max_score, text_embedding=None):
+    return speech_rate_result(doc.word_count/(duration/60))
+
+
+# Rubric bands: (low, high, score, rating[, suggestion]) with inclusive bounds, first match
+# wins; values falling in no band get the *_DEFAULT score. Shared with analytics.py.
+SPEECH_RATE_BANDS = [
+    (111, 140, 10, "Optimal", "Perfect speech rate!"),
+    (141, 160, 6, "Slightly fast", "Consider slowing down slightly for better clarity"),
+    (81, 110, 6, "Slightly slow", "Try speaking a bit faster to maintain engagement"),
+]
+SPEECH_RATE_DEFAULT = 2
+RICHNESS_BANDS = [
+    (0.9, 1.0, 10, "Excellent"),
+    (0.7, 0.89999999999, 8, "Very Good"),
+    (0.5, 0.6999999999999999, 6, "Good"),
+    (0.3, 0.4999999999999999, 4, "Fair"),
+]
+RICHNESS_DEFAULT = 2
+FILLER_RATE_BANDS = [
+    (0, 3, 15, "Excellent"),
+    (4, 6, 12, "Very Good"),
+    (7, 9, 9, "Good"),
+    (10, 12, 6, "Fair"),
+]
+FILLER_RATE_DEFAULT = 3
+SENTIMENT_BANDS = [
+    (0.999999999999, float('inf'), 15, "Excellent"),
+    (0.7, 0.8999999999999, 12, "Very Good"),
+    (0.5, 0.6999999999999, 9, "Good"),
+    (0.3, 0.4999999999999, 6, "Fair"),
+]
+SENTIMENT_DEFAULT = 3
+
+
+def find_band(value, bands):
+    """The (score, rating, ...) of the first band containing value, or None"""
+    for low, high, *band in bands:
+        if low <= value <= high:
+            return band
+    return None
+
+
+def speech_rate_result(rate):
+    band = find_band(rate, SPEECH_RATE_BANDS)
+    if band:
+        score, rating, suggestion = band
+    else:
+        score = SPEECH_RATE_DEFAULT
+        rating = "Too fast" if rate > 160 else "Too slow"
+        suggestion = "Adjust your speech pace significantly (aim for 110-140 wpm)"
+
+    feedback = {
+        'rate': round(rate, 2),
+        'rating': rating,
+        'optimal_range': '111-140 wpm',
+        'suggestion': suggestion
+    }
+    return score, feedback
+
+
+def error_criterion(doc, duration, max_score, text_embedding=None):
+    try:
+        count, error_details = get_grammar_error_count(doc.text)
+    except GrammarUnavailable as e:
+        return 0, unavailable_feedback('Error', e)
+    return error_result(count, doc.word_count, error_details)
+
+
+def error_result(count, words, error_details):
+    err = 1 - min((count/words)*10, 1)
     
-    return scores, detailed_feedback
+    if err >= 0.9:
+        score = 10
+        rating = "Excellent"
+    elif 0.7 <= err <= 0.899999999999:
+        score = 8
+        rating = "Very Good"
+    elif 0.5 <= err <= 0.699999999:
+        score = 6
+        rating = "Good"
+    elif 0.3 <= err <= 0.4999999:
+        score = 4
+        rating = "Fair"
+    else:
+        score = 2
+        rating = "Needs Improvement"
+
+    feedback = {
+        'error_count': count,
+        'error_rate': round((count/words)*100, 2),
+        'rating': rating,
+        'sample_errors': error_details,
+        'suggestion': f'Found {count} grammatical issues' if count > 0 else 'No grammatical errors detected!'
+    }
+    return score, feedback
+
+
+def richness_criterion(doc, duration, max_score, text_embedding=None):
+    with timed('step.mtld'):
+        diversity = LexicalDiversity()
+        diversity.extend(doc.lexical_tokens)
+        # A text without words scores the lowest band instead of failing the request
+        mtld_score = (diversity.mtld() or 0)/100
+    return richness_result(mtld_score, diversity.report())
+
+
+def richness_result(mtld_score, measures=None):
+    score, rating = find_band(mtld_score, RICHNESS_BANDS) or (RICHNESS_DEFAULT, "Needs Improvement")
+
+    feedback = {
+        'mtld_score': round(mtld_score, 3),
+        'rating': rating,
+        'suggestion': 'Try using more varied vocabulary' if score < 8 else 'Excellent vocabulary diversity!'
+    }
+    if measures:
+        feedback.update(measures)
+    return score, feedback
+
+
+def filler_word_rate_criterion(doc, duration, max_score, text_embedding=None):
+    return filler_result(find_fillers(doc.lowered), doc.word_count)
 
 
-def analyze_introduction(text, duration):
-    """Main function to analyze introduction and return structured results"""
-    print(f"Analyzing text of {len(text.split())} words...", file=sys.stderr)
+def filler_result(found_fillers, words):
+    filler_count = len(found_fillers)
+    fwr = filler_count/words*100
+    score, rating = find_band(fwr, FILLER_RATE_BANDS) or (FILLER_RATE_DEFAULT, "Needs Improvement")
+
+    feedback = {
+        'filler_count': filler_count,
+        'filler_rate': round(fwr, 2),
+        'found_fillers': found_fillers,
+        'rating': rating,
+        'suggestion': f'Reduce filler words: {", ".join(found_fillers[:3])}' if found_fillers else 'Great clarity!'
+    }
+    return score, feedback
+
+
+def sentiment_criterion(doc, duration, max_score, text_embedding=None):
+    return sentiment_result(*positive_word_probability(doc))
+
+
+def sentiment_result(prob, positive_words):
+    score, rating = find_band(prob, SENTIMENT_BANDS) or (SENTIMENT_DEFAULT, "Needs Improvement")
+
+    feedback = {
+        'positivity_score': prob,
+        'positive_words': positive_words[:10],
+        'rating': rating,
+        'suggestion': 'Add more positive and engaging words' if score < 12 else 'Great positive tone!'
+    }
+    return score, feedback
+
+
+def flow_criterion(doc, duration, max_score, text_embedding=None):
+    return flow_feedback(document_flow_order(doc, semantic=SENTENCE_EMBEDDINGS))
+
+
+def flow_feedback(flow_result):
+    score = 5 if flow_result['is_correct'] else 0
     
-    gradingCriterion = ["ContentAndStucture", "SpeechRate", "LanguageAndGrammar", "Clarity", "Engagement"]
-    subCriterion = {
-        "ContentAndStucture": ['Salutation', 'KeyWord', 'Flow'],
-        "SpeechRate": ['SpeechRate'],
-        "LanguageAndGrammar": ['Error', 'Richness'],
-        "Clarity": ['FillerWordRate'],
-        "Engagement": ['Sentiment']
+    feedback = {
+        'is_correct': flow_result['is_correct'],
+        'found_sections': flow_result['found_sections'],
+        'missing_sections': flow_result['missing_sections'],
+        'issue': flow_result['issue'],
+        'suggestion': flow_result['issue'] if not flow_result['is_correct'] else 'Perfect flow structure!'
     }
-    weights = {
-        'Salutation': 5, 'KeyWord': 30, 'Flow': 5, 'SpeechRate': 10,
-        'Error': 10, 'Richness': 10, 'FillerWordRate': 15, 'Sentiment': 15
+    return score, feedback
+
+
+# Rubric categories in result order, with their display names
+CATEGORIES = {
+    "ContentAndStucture": "Content & Structure",
+    "SpeechRate": "Speech Rate",
+    "LanguageAndGrammar": "Language & Grammar",
+    "Clarity": "Clarity",
+    "Engagement": "Engagement",
+}
+
+
+class Criterion:
+    """A registered criterion: its grading function, what it needs and how it is reported"""
+    __slots__ = ('name', 'grade', 'category', 'metric', 'feedback', 'resources', 'sentence_resources', 'views',
+                 'text_embedding', 'timer')
+
+    def __init__(self, name, grade, category, metric, feedback, resources, sentence_resources, views, text_embedding):
+        self.name = name
+        self.grade = grade
+        self.category = category
+        self.metric = metric
+        self.feedback = feedback
+        self.resources = list(resources)
+        self.sentence_resources = list(sentence_resources)
+        self.views = list(views)
+        self.text_embedding = text_embedding
+        self.timer = f'criterion.{name}'
+
+
+CRITERIA = {}
+# Compiled plans by (weights, enabled criteria, SENTENCE_EMBEDDINGS); register_criterion clears it
+_plans = {}
+
+
+def register_criterion(name, grade, category, metric, feedback, resources=(), sentence_resources=(), views=(),
+                       text_embedding=False):
+    """
+    Adds (or replaces) a rubric criterion. grade(doc, duration, max_score,
+    text_embedding) returns (score, feedback).
+    category: key of CATEGORIES the metric is reported under
+    metric: metric name in the result
+    feedback: summary line, formatted with score, max_score and speech_rate
+    resources: RESOURCE_LOADERS entries it needs (sentence_resources: extra
+        ones when SENTENCE_EMBEDDINGS is on)
+    views: Document views it reads, computed once before parallel criteria start
+    text_embedding: whether it scores the whole-text embedding that
+        encode_texts batches
+    """
+    CRITERIA[name] = Criterion(
+        name, grade, category, metric, feedback, resources, sentence_resources, views, text_embedding
+    )
+    _plans.clear()
+
+
+register_criterion('Salutation', salutation_criterion, 'ContentAndStucture', 'Salutation Level',
+                   'Salutation effectiveness: {score}/{max_score}')
+register_criterion('KeyWord', keyword_criterion, 'ContentAndStucture', 'Keyword Presence',
+                   'Key information coverage: {score}/{max_score}', resources=['keyword_grader'], text_embedding=True)
+register_criterion('Flow', flow_criterion, 'ContentAndStucture', 'Flow & Structure',
+                   'Introduction flow: {score}/{max_score}', sentence_resources=['flow_centroids'], views=['sections'])
+register_criterion('SpeechRate', speech_rate_criterion, 'SpeechRate', 'Speech Rate (words/min)',
+                   'Speech pace: {speech_rate} words/minute', views=['words'])
+register_criterion('Error', error_criterion, 'LanguageAndGrammar', 'Grammar Accuracy',
+                   'Grammar and language accuracy', resources=['grammar_tool'], views=['words'])
+register_criterion('Richness', richness_criterion, 'LanguageAndGrammar', 'Vocabulary Richness',
+                   'Vocabulary diversity and richness', views=['lexical_tokens'])
+register_criterion('FillerWordRate', filler_word_rate_criterion, 'Clarity', 'Filler Word Rate',
+                   'Clarity and filler word usage', views=['words'])
+register_criterion('Sentiment', sentiment_criterion, 'Engagement', 'Sentiment & Positivity',
+                   'Positive tone and engagement', resources=['sentiment_analyzer'], views=['tokens'])
+
+# Parallel criterion execution, configured from GRADER_PARALLEL / GRADER_CRITERION_TIMEOUT
+PARALLEL_GRADING = os.environ.get('GRADER_PARALLEL', '0') == '1'
+CRITERION_TIMEOUT = float(os.environ['GRADER_CRITERION_TIMEOUT']) if os.environ.get('GRADER_CRITERION_TIMEOUT') else None
+_criterion_pool = None
+_criterion_pool_lock = threading.Lock()
+
+
+def get_criterion_pool():
+    global _criterion_pool
+    if _criterion_pool is None:
+        with _criterion_pool_lock:
+            if _criterion_pool is None:
+                # Timed-out criteria keep their thread until they finish, so leave headroom
+                workers = int(os.environ.get('GRADER_THREADS', 2 * len(CRITERIA)))
+                _criterion_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='criterion')
+    return _criterion_pool
+
+
+def run_criterion(criteria, doc, duration, max_score, text_embedding=None):
+    criterion = CRITERIA[criteria]
+    with timed(criterion.timer):
+        return criterion.grade(doc, duration, max_score, text_embedding)
+
+
+def degraded_feedback(criteria, timeout):
+    return {
+        'degraded': True,
+        'issue': f'{criteria} check timed out after {timeout}s',
+        'suggestion': 'This metric could not be evaluated in time; please resubmit to get it scored'
     }
 
-    scores, detailed_feedback = grade(text, gradingCriterion, subCriterion, weights, duration)
-    overall_score = sum(scores.values())
-    word_count = len(text.split())
-    speech_rate = word_count / (duration / 60) if duration > 0 else 0
-    
-    result = {
-        "overallScore": overall_score,
-        "totalDuration": duration,
-        "wordCount": word_count,
-        "speechRate": round(speech_rate, 2),
-        "criteriaScores": [
-            {
-                "category": "Content & Structure",
-                "metrics": [
-                    {"name": "Salutation Level", "score": scores.get('Salutation', 0), "maxScore": weights['Salutation'],
-                     "feedback": f"Salutation effectiveness: {scores.get('Salutation', 0)}/{weights['Salutation']}", "details": detailed_feedback.get('Salutation', {})},
-                    {"name": "Keyword Presence", "score": scores.get('KeyWord', 0), "maxScore": weights['KeyWord'],
-                     "feedback": f"Key information coverage: {scores.get('KeyWord', 0)}/{weights['KeyWord']}", "details": detailed_feedback.get('KeyWord', {})},
-                    {"name": "Flow & Structure", "score": scores.get('Flow', 0), "maxScore": weights['Flow'],
-                     "feedback": f"Introduction flow: {scores.get('Flow', 0)}/{weights['Flow']}", "details": detailed_feedback.get('Flow', {})}
-                ]
-            },
-            {
-                "category": "Speech Rate",
-                "metrics": [
-                    {"name": "Speech Rate (words/min)", "score": scores.get('SpeechRate', 0), "maxScore": weights['SpeechRate'],
-                     "feedback": f"Speech pace: {round(speech_rate, 2)} words/minute", "details": detailed_feedback.get('SpeechRate', {})}
-                ]
-            },
-            {
-                "category": "Language & Grammar",
-                "metrics": [
-                    {"name": "Grammar Accuracy", "score": scores.get('Error', 0), "maxScore": weights['Error'],
-                     "feedback": "Grammar and language accuracy", "details": detailed_feedback.get('Error', {})},
-                    {"name": "Vocabulary Richness", "score": scores.get('Richness', 0), "maxScore": weights['Richness'],
-                     "feedback": "Vocabulary diversity and richness", "details": detailed_feedback.get('Richness', {})}
-                ]
-            },
-            {
-                "category": "Clarity",
-                "metrics": [
-                    {"name": "Filler Word Rate", "score": scores.get('FillerWordRate', 0), "maxScore": weights['FillerWordRate'],
-                     "feedback": "Clarity and filler word usage", "details": detailed_feedback.get('FillerWordRate', {})}
-                ]
-            },
-            {
-                "category": "Engagement",
-                "metrics": [
-                    {"name": "Sentiment & Positivity", "score": scores.get('Sentiment', 0), "maxScore": weights['Sentiment'],
-                     "feedback": "Positive tone and engagement", "details": detailed_feedback.get('Sentiment', {})}
-                ]
-            }
-        ]
+
+def unavailable_feedback(criteria, reason):
+    return {
+        'degraded': True,
+        'issue': f'{criteria} check unavailable: {reason}',
+        'suggestion': 'This metric could not be evaluated right now; please resubmit to get it scored'
     }
+
+
+class RubricPlan:
+    """
+    A rubric compiled once: the criteria to run with their max scores, the
+    resources and Document views they need, and the result layout. Every
+    criterion in weights is reported; only the enabled ones are graded, the
+    rest score 0 with empty details.
+    """
+    def __init__(self, weights, criteria=None):
+        self.weights = dict(weights)
+        self.steps = [
+            (name, max_score) for name, max_score in self.weights.items()
+            if name in CRITERIA and (criteria is None or name in criteria)
+        ]
+        enabled = [CRITERIA[name] for name, _ in self.steps]
+        self.resources = resources_for([criterion.name for criterion in enabled])
+        self.views = list(dict.fromkeys(view for criterion in enabled for view in criterion.views))
+        self.text_embedding = any(criterion.text_embedding for criterion in enabled)
+        self.layout = []
+        for category, display_name in CATEGORIES.items():
+            metrics = [
+                (CRITERIA[name], max_score) for name, max_score in self.weights.items()
+                if name in CRITERIA and CRITERIA[name].category == category
+            ]
+            if metrics:
+                self.layout.append((display_name, metrics))
+
+    def run(self, doc, duration, text_embedding=None, parallel=None, timeout=None):
+        """
+        Grades doc on every enabled criterion. With parallel=True (default:
+        GRADER_PARALLEL) criteria run concurrently on a shared thread pool; a
+        criterion that does not finish within timeout seconds (default:
+        GRADER_CRITERION_TIMEOUT) scores 0 with degraded feedback instead of
+        failing the whole request.
+        """
+        parallel = PARALLEL_GRADING if parallel is None else parallel
+        timeout = CRITERION_TIMEOUT if timeout is None else timeout
+        scores = {}
+        detailed_feedback = {name: {} for name in self.weights}
+
+        if not parallel:
+            for criteria, max_score in self.steps:
+                scores[criteria], detailed_feedback[criteria] = run_criterion(
+                    criteria, doc, duration, max_score, text_embedding
+                )
+            return scores, detailed_feedback
+
+        # Shared views are computed here once instead of racing in every thread
+        for view in self.views:
+            getattr(doc, view)
+        pool = get_criterion_pool()
+        # Each task runs in a copy of this context so its timings reach the current request
+        futures = [
+            (criteria, pool.submit(
+                contextvars.copy_context().run, run_criterion, criteria, doc, duration, max_score, text_embedding
+            ))
+            for criteria, max_score in self.steps
+        ]
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        for criteria, future in futures:
+            try:
+                remaining = max(deadline - time.monotonic(), 0) if deadline is not None else None
+                scores[criteria], detailed_feedback[criteria] = future.result(timeout=remaining)
+            except FutureTimeout:
+                print(f"{criteria} timed out after {timeout}s", file=sys.stderr)
+                scores[criteria] = 0
+                detailed_feedback[criteria] = degraded_feedback(criteria, timeout)
+                METRICS.increment('criterion_timeouts')
+
+        return scores, detailed_feedback
+
+    def build_result(self, scores, detailed_feedback, duration, word_count):
+        """The analyze_introduction result layout for graded scores and feedback"""
+        speech_rate = round(word_count / (duration / 60) if duration > 0 else 0, 2)
+        return {
+            "overallScore": sum(scores.values()),
+            "totalDuration": duration,
+            "wordCount": word_count,
+            "speechRate": speech_rate,
+            "criteriaScores": [
+                {
+                    "category": category,
+                    "metrics": [
+                        {"name": criterion.metric, "score": scores.get(criterion.name, 0), "maxScore": max_score,
+                         "feedback": criterion.feedback.format(
+                             score=scores.get(criterion.name, 0), max_score=max_score, speech_rate=speech_rate),
+                         "details": detailed_feedback.get(criterion.name, {})}
+                        for criterion, max_score in metrics
+                    ]
+                }
+                for category, metrics in self.layout
+            ]
+        }
+
+
+def rubric_plan(criteria=None, weights=None):
+    """The compiled plan for a rubric (default WEIGHTS), grading only criteria when given"""
+    weights = WEIGHTS if weights is None else weights
+    key = (tuple(weights.items()), tuple(sorted(criteria)) if criteria is not None else None, SENTENCE_EMBEDDINGS)
+    plan = _plans.get(key)
+    if plan is None:
+        plan = _plans[key] = RubricPlan(weights, criteria)
+    return plan
+
+
+def grade(text, gradingCriterion, subCriterion, weights, duration, text_embedding=None, parallel=None, timeout=None,
+          document=None):
+    """
+    Grades text on every criterion in weights ({criterion: max score}) and
+    returns (scores, detailed_feedback). gradingCriterion and subCriterion are
+    kept for existing callers and ignored: categories come from CRITERIA.
+    document is the text's Document when the caller already built one;
+    parallel and timeout as in RubricPlan.run.
+    """
+    doc = document if document is not None else Document(text)
+    return rubric_plan(weights=weights).run(doc, duration, text_embedding, parallel, timeout)
+
+
+# Timing/profiling options, configured from GRADER_TIMINGS / GRADER_PROFILE_EVERY / GRADER_PROFILE_DIR
+INCLUDE_TIMINGS = os.environ.get('GRADER_TIMINGS', '0') == '1'
+PROFILER = SamplingProfiler(int(os.environ.get('GRADER_PROFILE_EVERY', 0)), os.environ.get('GRADER_PROFILE_DIR', '.'))
+
+
+WEIGHTS = {
+    'Salutation': 5, 'KeyWord': 30, 'Flow': 5, 'SpeechRate': 10,
+    'Error': 10, 'Richness': 10, 'FillerWordRate': 15, 'Sentiment': 15
+}
+
+
+def analyze_introduction(text, duration, text_embedding=None, criteria=None, include_timings=None):
+    """
+    Main function to analyze introduction and return structured results.
+    text_embedding can be passed in when the text was already encoded by
+    KeywordGrader.encode_text (e.g. as part of a batch). criteria restricts
+    grading to a subset of the rubric; skipped criteria score 0.
+    Results are served from RESULT_CACHE when the same input was graded before.
+    With include_timings (default: GRADER_TIMINGS) the result gets a "timings"
+    block with wall/CPU time per criterion and sub-step.
+    """
+    include_timings = INCLUDE_TIMINGS if include_timings is None else include_timings
+    METRICS.increment('requests')
     
-    print("Analysis complete!", file=sys.stderr)
+    with collect() as timings:
+        with timed('request'):
+            cache_key = None
+            result = None
+            if RESULT_CACHE is not None:
+                cache_key = result_cache_key(text, duration, criteria)
+                result = RESULT_CACHE.get(cache_key)
+                if result is not None:
+                    print("Serving cached analysis", file=sys.stderr)
+                    METRICS.increment('cache_hits')
+            cached = result is not None
+            
+            if result is None:
+                result, degraded = PROFILER.run(_analyze, text, duration, text_embedding, criteria)
+                # Degraded (timed-out) metrics must be recomputed next time, not cached
+                if cache_key is not None and not degraded:
+                    RESULT_CACHE.put(cache_key, result)
+    
+    if include_timings:
+        result["timings"] = {
+            'cached': cached,
+            'total': timings.get('request'),
+            'criteria': {name[len('criterion.'):]: t for name, t in timings.items() if name.startswith('criterion.')},
+            'steps': {name[len('step.'):]: t for name, t in timings.items() if name.startswith('step.')},
+        }
     return result
 
 
+def _analyze(text, duration, text_embedding=None, criteria=None):
+    """Grades text and builds the result layout; returns (result, degraded)"""
+    doc = Document(text)
+    print(f"Analyzing text of {doc.word_count} words...", file=sys.stderr)
+    
+    plan = rubric_plan(criteria)
+    scores, detailed_feedback = plan.run(doc, duration, text_embedding)
+    result = plan.build_result(scores, detailed_feedback, duration, doc.word_count)
+    
+    degraded = any(feedback.get('degraded') for feedback in detailed_feedback.values())
+    
+    print("Analysis complete!", file=sys.stderr)
+    return result, degraded
+
+
+def build_result(scores, detailed_feedback, duration, word_count):
+    """The analyze_introduction result layout for the full rubric"""
+    return rubric_plan().build_result(scores, detailed_feedback, duration, word_count)
+
+
+def encode_texts(texts, criteria=None, batch_size=32):
+    """
+    Encodes many texts for the KeyWord criterion in one model call. Returns one
+    embedding per text, None for texts that aren't non-empty strings (or for
+    all of them when no enabled criterion scores the text embedding).
+    """
+    embeddings = [None] * len(texts)
+    # With sentence embeddings each Document encodes its text and sentences itself
+    if SENTENCE_EMBEDDINGS or not rubric_plan(criteria).text_embedding:
+        return embeddings
+    valid = [i for i, text in enumerate(texts) if isinstance(text, str) and text.strip()]
+    if valid:
+        encoded = get_sentence_model().encode(
+            [texts[i].lower() for i in valid],
+            batch_size=batch_size, convert_to_tensor=True, normalize_embeddings=True
+        )
+        for position, i in enumerate(valid):
+            embeddings[i] = encoded[position]
+    return embeddings
+
+
+def analyze_introductions(items, batch_size=32, start=0, criteria=None, exact=False):
+    """
+    Grades many introductions, yielding (index, result) as each one finishes.
+    items is any iterable of {"introduction": ..., "duration": ...} dicts and is
+    consumed lazily, batch_size at a time, so memory stays bounded. Texts in a
+    batch go through the sentence model's encode in one call. Items before `start`
+    are skipped so an interrupted run can be resumed. A failing item yields the
+    same error result as the single-request CLI instead of stopping the run.
+    criteria restricts grading as in analyze_introduction.
+    Padded batch encodes are not bit-identical to encoding one text: keyword
+    similarities can differ by about 1e-3, enough to flip a category sitting at
+    the 0.2 threshold. With exact, each text is encoded on its own like a single
+    request, so stored scores are reproduced exactly (at single-request speed).
+    """
+    iterator = itertools.islice(items, start, None)
+    index = start
+
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            break
+
+        texts = [item.get('introduction') if isinstance(item, dict) else None for item in batch]
+        embeddings = [None] * len(batch) if exact else encode_texts(texts, criteria, batch_size)
+
+        for i, item in enumerate(batch):
+            try:
+                result = analyze_introduction(item['introduction'], item['duration'], embeddings[i], criteria)
+            except Exception as e:
+                print(f"Error in item {index}: {str(e)}", file=sys.stderr)
+                result = {"error": str(e), "overallScore": 0, "criteriaScores": []}
+            yield index, result
+            index += 1
+
+
+def handle_request(request, criteria=None):
+    """Grade one worker request and build the response line payload"""
+    request_id = request.get('id')
+    try:
+        text = request['introduction']
+        duration = request['duration']
+        result = analyze_introduction(text, duration, criteria=criteria, include_timings=request.get('timings'))
+        store_result(result, text, duration, request.get('submission'))
+        return {"id": request_id, "ok": True, "result": result}
+    except Exception as e:
+        print(f"Error in request {request_id}: {str(e)}", file=sys.stderr)
+        return {"id": request_id, "ok": False, "error": str(e)}
+
+
+def parse_request(line):
+    """Returns (request, None) for a valid worker line or (None, error payload)"""
+    try:
+        request = json.loads(line)
+    except json.JSONDecodeError as e:
+        return None, {"id": None, "ok": False, "error": f"Invalid JSON: {str(e)}"}
+    if not isinstance(request, dict):
+        return None, {"id": None, "ok": False, "error": "Request must be a JSON object"}
+    return request, None
+
+
+def worker_stats(scheduler=None):
+    return {
+        "cache": RESULT_CACHE.report() if RESULT_CACHE is not None else None,
+        "grammar_cache": GRAMMAR_CACHE.report() if GRAMMAR_CACHE is not None else None,
+        "grammar": _resources['grammar_tool'].report() if 'grammar_tool' in _resources else None,
+        "scheduler": scheduler.report() if scheduler is not None else None,
+        "store": RESULT_STORE.report() if RESULT_STORE is not None else None,
+    }
+
+
+def worker_metrics(request):
+    """{"op": "metrics", "format": "prometheus"} returns text; anything else JSON"""
+    payload = {"id": request.get('id'), "ok": True, "event": "metrics"}
+    if request.get('format') == 'prometheus':
+        payload["text"] = METRICS.to_prometheus()
+    else:
+        payload["metrics"] = METRICS.to_json()
+        if PROFILER.last_summary is not None:
+            payload["last_profile"] = PROFILER.last_summary
+    return payload
+
+
+def worker_results(request):
+    """
+    Reads from RESULT_STORE: {"op": "results", "submission": id} returns its
+    latest "record" (every version with "versions": true); without a
+    submission, one page of "records" newest first, continued by passing the
+    returned "next" cursor as "before".
+    """
+    request_id = request.get('id')
+    if RESULT_STORE is None:
+        return {"id": request_id, "ok": False, "error": "Result store is not enabled (set GRADER_STORE_PATH)"}
+    try:
+        payload = {"id": request_id, "ok": True, "event": "results"}
+        submission = request.get('submission')
+        if submission is not None and request.get('versions'):
+            payload["records"] = RESULT_STORE.versions(submission)
+        elif submission is not None:
+            payload["record"] = RESULT_STORE.get(submission)
+        else:
+            limit = min(max(int(request.get('limit', 20)), 1), 1000)
+            payload["records"], payload["next"] = RESULT_STORE.history(request.get('before'), limit)
+        return payload
+    except Exception as e:
+        print(f"Error in request {request_id}: {str(e)}", file=sys.stderr)
+        return {"id": request_id, "ok": False, "error": str(e)}
+
+
+# Live-session ops handled by streaming.handle_stream
+STREAM_OPS = ('stream_open', 'stream_chunk', 'stream_close')
+
+
+def dispatch(request, send, handlers, stats):
+    """
+    Answers one parsed request for any serve mode. handlers maps the ops the
+    mode grades itself (analyze, stream ops, ...) to callables taking the
+    request; ping, stats (fields from stats()), metrics and results are
+    answered here and unknown ops get an error. A failing request is answered
+    with ok: false instead of stopping the loop. Returns False on shutdown,
+    which the caller acknowledges once it has stopped.
+    """
+    request_id = request.get('id')
+    op = request.get('op', 'analyze')
+    if op == 'shutdown':
+        return False
+    try:
+        handler = handlers.get(op) if isinstance(op, str) else None
+        if handler is not None:
+            handler(request)
+        elif op == 'ping':
+            send({"id": request_id, "ok": True, "event": "pong"})
+        elif op == 'stats':
+            send({"id": request_id, "ok": True, "event": "stats", **stats()})
+        elif op == 'metrics':
+            send(worker_metrics(request))
+        elif op == 'results':
+            send(worker_results(request))
+        else:
+            send({"id": request_id, "ok": False, "error": f"Unknown op: {op}"})
+    except Exception as e:
+        print(f"Error in request {request_id}: {str(e)}", file=sys.stderr)
+        send({"id": request_id, "ok": False, "error": str(e)})
+    return True
+
+
+def serve(stdin=None, stdout=None, criteria=None, batching=None, workers=None):
+    """
+    Long-lived worker loop speaking newline-delimited JSON.
+    Each input line is {"id": ..., "introduction": ..., "duration": ...};
+    each output line is {"id": ..., "ok": true, "result": {...}} or
+    {"id": ..., "ok": false, "error": "..."}. Models stay loaded between requests.
+    Stops on EOF, on {"op": "shutdown"} or on SIGTERM/SIGINT.
+    Everything the enabled criteria need is loaded before "ready" is sent.
+    With batching (a dict of BatchScheduler options) requests are graded
+    concurrently in micro-batches and replies may arrive out of order.
+    Live transcripts are graded incrementally with the stream_open /
+    stream_chunk / stream_close ops (see streaming.py). With RESULT_STORE
+    enabled, results are stored under the request's "submission" id and read
+    back with the results op.
+    With workers, requests are graded by that many pre-forked processes that
+    share the parent's models (see prefork.py).
+    """
+    stdin = stdin if stdin is not None else sys.stdin
+    out = stdout if stdout is not None else sys.stdout
+    # Anything else that prints to stdout would corrupt the protocol
+    sys.stdout = sys.stderr
+    
+    write_lock = threading.Lock()
+
+    def send(payload):
+        with write_lock:
+            out.write(json.dumps(payload) + "\n")
+            out.flush()
+
+    warmup(criteria)
+    pool = None
+    if workers:
+        from prefork import WorkerPool
+        pool = WorkerPool(workers, criteria)
+    ready = {"id": None, "ok": True, "event": "ready", "startup": startup_report()}
+    if pool is not None:
+        ready["memory"] = pool.memory_report()
+    send(ready)
+    print("Worker ready", file=sys.stderr)
+
+    try:
+        if pool is not None:
+            _serve_prefork(stdin, send, pool)
+        elif batching is not None:
+            asyncio.run(_serve_batched(stdin, send, criteria, batching))
+        else:
+            _serve_sequential(stdin, send, criteria)
+    finally:
+        if RESULT_STORE is not None:
+            RESULT_STORE.flush()
+        sys.stdout = out
+        print("Worker stopped", file=sys.stderr)
+
+
+def _serve_sequential(stdin, send, criteria):
+    state = {'running': True, 'busy': False}
+    sessions = {}
+
+    def stream(request):
+        from streaming import handle_stream
+        send(handle_stream(request, sessions, criteria))
+
+    handlers = {'analyze': lambda request: send(handle_request(request, criteria)), **dict.fromkeys(STREAM_OPS, stream)}
+
+    def stop(signum, frame):
+        # Finish the request in flight, but don't wait for another line if idle
+        print(f"Received signal {signum}, shutting down...", file=sys.stderr)
+        state['running'] = False
+        if not state['busy']:
+            raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    try:
+        while state['running']:
+            state['busy'] = False
+            line = stdin.readline()
+            if not line:
+                break
+            line = line.strip()
+            if not line:
+                continue
+            state['busy'] = True
+
+            request, error = parse_request(line)
+            if error:
+                send(error)
+                continue
+
+            if not dispatch(request, send, handlers, worker_stats):
+                send({"id": request.get('id'), "ok": True, "event": "shutdown"})
+                break
+    except KeyboardInterrupt:
+        pass
+
+
+def _serve_prefork(stdin, send, pool):
+    state = {'running': True}
+
+    def stop(signum, frame):
+        print(f"Received signal {signum}, shutting down...", file=sys.stderr)
+        state['running'] = False
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    pool.start(send)
+    request = None
+    # Workers write the store and keep their own metrics; the parent reads the store
+    handlers = dict.fromkeys(('analyze', 'metrics') + STREAM_OPS, pool.submit)
+
+    def stats():
+        return {"memory": pool.memory_report()}
+
+    try:
+        while state['running']:
+            line = stdin.readline()
+            if not line:
+                break
+            line = line.strip()
+            if not line:
+                continue
+
+            request, error = parse_request(line)
+            if error:
+                send(error)
+                continue
+
+            if not dispatch(request, send, handlers, stats):
+                break
+    except KeyboardInterrupt:
+        request = None
+    finally:
+        # Requests already handed to workers are finished before exiting
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        pool.stop()
+    if request is not None and request.get('op') == 'shutdown':
+        send({"id": request.get('id'), "ok": True, "event": "shutdown"})
+
+
+async def _serve_batched(stdin, send, criteria, batching):
+    from scheduler import BatchScheduler, QueueFull
+
+    loop = asyncio.get_running_loop()
+    scheduler = BatchScheduler(
+        lambda text, duration, embedding, timings: analyze_introduction(text, duration, embedding, criteria, timings),
+        lambda texts: encode_texts(texts, criteria, len(texts)),
+        **batching
+    )
+    await scheduler.start()
+
+    stopping = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+
+    async def handle(request):
+        request_id = request.get('id')
+        try:
+            result = await scheduler.submit(request['introduction'], request['duration'], request.get('timings'))
+            store_result(result, request['introduction'], request['duration'], request.get('submission'))
+            send({"id": request_id, "ok": True, "result": result})
+        except QueueFull as e:
+            send({"id": request_id, "ok": False, "error": str(e), "status": 429})
+        except Exception as e:
+            print(f"Error in request {request_id}: {str(e)}", file=sys.stderr)
+            send({"id": request_id, "ok": False, "error": str(e)})
+
+    sessions = {}
+    session_locks = {}
+
+    async def stream(request):
+        # Chunks of one session are applied in arrival order, off the event loop
+        from streaming import handle_stream, invalid_session
+        error = invalid_session(request)
+        if error:
+            send(error)
+            return
+        lock = session_locks.setdefault(request['session'], asyncio.Lock())
+        async with lock:
+            send(await loop.run_in_executor(None, handle_stream, request, sessions, criteria))
+        if request.get('op') == 'stream_close':
+            session_locks.pop(request['session'], None)
+
+    tasks = set()
+
+    def spawn(handler):
+        def start(request):
+            task = loop.create_task(handler(request))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        return start
+
+    handlers = {'analyze': spawn(handle), **dict.fromkeys(STREAM_OPS, spawn(stream))}
+    stop_wait = loop.create_task(stopping.wait())
+    # A daemon thread feeds lines in, so a blocked read never holds up shutdown
+    lines = asyncio.Queue()
+
+    def read_lines():
+        for line in stdin:
+            loop.call_soon_threadsafe(lines.put_nowait, line)
+        loop.call_soon_threadsafe(lines.put_nowait, None)
+
+    threading.Thread(target=read_lines, daemon=True).start()
+
+    while True:
+        next_line = loop.create_task(lines.get())
+        await asyncio.wait({next_line, stop_wait}, return_when=asyncio.FIRST_COMPLETED)
+        if stopping.is_set():
+            next_line.cancel()
+            print("Received signal, shutting down...", file=sys.stderr)
+            break
+        line = next_line.result()
+        if line is None:
+            break
+        line = line.strip()
+        if not line:
+            continue
+
+        request, error = parse_request(line)
+        if error:
+            send(error)
+            continue
+
+        if not dispatch(request, send, handlers, lambda: worker_stats(scheduler)):
+            send({"id": request.get('id'), "ok": True, "event": "shutdown"})
+            break
+
+    # Requests already accepted are finished before exiting
+    if tasks:
+        await asyncio.gather(*tasks)
+    await scheduler.stop()
+    stop_wait.cancel()
+
+
+configure_cache()
+configure_store()
+
+MODULE_IMPORT_TIME = round(time.perf_counter() - _MODULE_START, 4)
+
+
+def parse_criteria(value):
+    return [criterion.strip() for criterion in value.split(',') if criterion.strip()] if value else None
+
+
 if __name__ == "__main__":
+    import argparse
+
+    # Modules imported later (streaming) must share this instance's models and settings
+    sys.modules.setdefault('main', sys.modules[__name__])
+
+    parser = argparse.ArgumentParser(description='Grade a self-introduction transcript')
+    parser.add_argument('input', nargs='?', help='JSON object with "introduction" and "duration"')
+    parser.add_argument('--serve', action='store_true', help='Run as a long-lived NDJSON worker on stdin/stdout')
+    parser.add_argument('--criteria', help='Comma-separated rubric subset, e.g. SpeechRate,FillerWordRate')
+    parser.add_argument('--startup-report', action='store_true', help='Print import/load time per component to stderr')
+    parser.add_argument('--parallel', action='store_true', help='Run independent criteria concurrently')
+    parser.add_argument('--batch', action='store_true', help='With --serve, grade concurrent requests in micro-batches')
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=10)
+    parser.add_argument('--max-queue', type=int, default=256, help='Pending requests before new ones get a 429')
+    parser.add_argument('--workers', type=int, help='With --serve, grade in this many pre-forked processes sharing the models')
+    parser.add_argument('--timings', action='store_true', help='Include per-criterion timings in the result')
+    parser.add_argument('--profile-every', type=int, help='cProfile every Nth request (stats go to GRADER_PROFILE_DIR)')
+    parser.add_argument('--criterion-timeout', type=float, help='Seconds before a parallel criterion is scored as degraded')
+    parser.add_argument('--embedding-backend', choices=['torch', 'int8', 'onnx'], help='Sentence model backend')
+    parser.add_argument('--embedding-threads', type=int, help='Intra-op threads for the sentence model')
+    parser.add_argument('--sentence-embeddings', action='store_true',
+                        help='Score KeyWord per sentence and classify unmatched Flow sentences by embedding')
+    parser.add_argument('--store', help='SQLite file to persist every result to (overrides GRADER_STORE_PATH)')
+    args = parser.parse_args()
+    if args.store:
+        configure_store(args.store)
+    if args.embedding_backend:
+        EMBEDDING_BACKEND = args.embedding_backend
+    if args.embedding_threads:
+        EMBEDDING_THREADS = args.embedding_threads
+    if args.sentence_embeddings:
+        SENTENCE_EMBEDDINGS = True
+    if args.parallel:
+        PARALLEL_GRADING = True
+    if args.criterion_timeout is not None:
+        CRITERION_TIMEOUT = args.criterion_timeout
+    if args.timings:
+        INCLUDE_TIMINGS = True
+    if args.profile_every is not None:
+        PROFILER.every = args.profile_every
+    criteria = parse_criteria(args.criteria)
+
+    if args.serve:
+        batching = None
+        if args.batch:
+            batching = {'max_batch_size': args.max_batch_size, 'max_wait_ms': args.max_wait_ms, 'max_queue': args.max_queue}
+        serve(criteria=criteria, batching=batching, workers=args.workers)
+        if args.startup_report:
+            print(json.dumps(startup_report()), file=sys.stderr)
+        sys.exit(0)
+
     try:
-        input_data = json.loads(sys.argv[1])
+        input_data = json.loads(args.input)
         text = input_data['introduction']
         duration = input_data['duration']
         
-        result = analyze_introduction(text, duration)
+        result = analyze_introduction(text, duration, criteria=criteria)
+        store_result(result, text, duration, input_data.get('submission'))
         print(json.dumps(result))
         
     except Exception as e:
         print(f"Error: {str(e)}", file=sys.stderr)
-        error_result = {"error": str(e), "overallScore": 0, "criteriaScores": []}
-        print(json.dumps(error_result))
\ No newline at end of file
+        failure = {"error": str(e), "overallScore": 0, "criteriaScores": []}
+        print(json.dumps(failure))
+
+    if RESULT_STORE is not None:
+        RESULT_STORE.flush()
+    if args.startup_report:
+        print(json.dumps(startup_report()), file=sys.stderr)
@@ -0,0 +1,250 @@
+"""
+Pre-forked grading workers sharing one copy of the models.
+
+The parent loads everything the enabled criteria need, puts the model in
+inference mode, collects and freezes the GC heap (so reference-count and GC
+writes in the children don't touch the parent's pages), then forks `size`
+children. Tensors are read-only from then on, so fork shares their pages
+copy-on-write; they are not moved to /dev/shm, which is only 64 MB in a
+default Docker container. Each child grades requests from its own queue and puts replies on a
+shared queue the parent writes out. Analyze requests go to the worker with
+the fewest pending requests; a stream session stays on the worker it was
+opened on. The reply reader checks every DEATH_CHECK_INTERVAL seconds for workers
+that died, answers their pending requests with an error and drops their
+stream sessions. A dead worker is forked again on the next dispatch, from the
+main thread: a child forked from the reader thread would hang closing the
+stdin the main thread is blocked reading.
+
+memory_report() reads /proc/<pid>/smaps_rollup for the parent and every
+worker, splitting RSS into shared and private pages.
+"""
+import gc
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+
+import main
+from streaming import invalid_session
+
+# Seconds between checks for dead workers
+DEATH_CHECK_INTERVAL = 1.0
+
+
+def freeze_models():
+    """Puts the model in inference mode and freezes the current heap before forking"""
+    model = main._resources.get('sentence_model')
+    if model is not None:
+        model.eval()
+        for parameter in model.parameters():
+            parameter.requires_grad_(False)
+    gc.collect()
+    gc.freeze()
+
+
+def memory_usage(pid):
+    """rss, pss, shared and private memory of a process in MB (None where smaps_rollup is unavailable)"""
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1])
+    except OSError:
+        return None
+
+    def mb(*names):
+        return round(sum(fields.get(name, 0) for name in names) / 1024, 1)
+
+    return {
+        'rss': mb('Rss'),
+        'pss': mb('Pss'),
+        'shared': mb('Shared_Clean', 'Shared_Dirty'),
+        'private': mb('Private_Clean', 'Private_Dirty'),
+    }
+
+
+def _worker_main(index, requests, responses, criteria):
+    # The parent handles SIGINT and shuts workers down through their queues
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    # Nothing opened or locked by the parent may be used after fork
+    main.RESULT_CACHE = None
+    main.configure_cache()
+    # The parent's connections and writer thread don't survive the fork
+    store, main.RESULT_STORE = main.RESULT_STORE, None
+    if store is not None:
+        main.configure_store(store.path)
+    grammar_tool = main._resources.get('grammar_tool')
+    if grammar_tool is not None:
+        grammar_tool.after_fork()
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(main.EMBEDDING_THREADS or 1)
+
+    sessions = {}
+    while True:
+        request = requests.get()
+        if request is None:
+            if main.RESULT_STORE is not None:
+                main.RESULT_STORE.flush()
+            break
+        op = request.get('op', 'analyze')
+        if op in main.STREAM_OPS:
+            from streaming import handle_stream
+            payload = handle_stream(request, sessions, criteria)
+        elif op == 'metrics':
+            payload = main.worker_metrics(request)
+            payload['worker'] = index
+        else:
+            payload = main.handle_request(request, criteria)
+        responses.put((index, payload))
+
+
+class WorkerPool:
+    def __init__(self, size, criteria=None):
+        self.criteria = criteria
+        self.context = multiprocessing.get_context('fork')
+        self.responses = self.context.Queue()
+        self.queues = [None] * size
+        self.processes = [None] * size
+        self.pending = [[] for _ in range(size)]
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.revive_lock = threading.RLock()
+        self.dead = set()
+        self.stopping = False
+        self.restarts = 0
+        self.send = None
+        self.reader = None
+
+        freeze_models()
+        for index in range(size):
+            self._fork(index)
+
+    def _fork(self, index):
+        self.queues[index] = self.context.Queue()
+        process = self.context.Process(
+            target=_worker_main, args=(index, self.queues[index], self.responses, self.criteria),
+            name=f'grader-{index}', daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self, send):
+        """Starts writing worker replies with send(payload)"""
+        self.send = send
+        self.reader = threading.Thread(target=self._read_responses, daemon=True, name='worker-replies')
+        self.reader.start()
+
+    def _read_responses(self):
+        checked = time.monotonic()
+        while True:
+            try:
+                item = self.responses.get(timeout=DEATH_CHECK_INTERVAL)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                index, payload = item
+                with self.lock:
+                    if payload.get('id') in self.pending[index]:
+                        self.pending[index].remove(payload.get('id'))
+                self.send(payload)
+            if time.monotonic() - checked >= DEATH_CHECK_INTERVAL:
+                checked = time.monotonic()
+                for index in range(len(self.processes)):
+                    self._bury(index)
+
+    def _bury(self, index):
+        """If the worker died: fails the requests it held and drops its sessions; True when it is dead"""
+        with self.revive_lock:
+            process = self.processes[index]
+            if self.stopping or process.is_alive():
+                return False
+            if index in self.dead:
+                return True
+            self.dead.add(index)
+            print(f"Worker {index} (pid {process.pid}) exited with {process.exitcode}", file=sys.stderr)
+            with self.lock:
+                lost, self.pending[index] = self.pending[index], []
+                for session, owner in list(self.sessions.items()):
+                    if owner == index:
+                        del self.sessions[session]
+            for request_id in lost:
+                self.send({"id": request_id, "ok": False, "error": f"Worker {index} exited while grading"})
+            return True
+
+    def _revive(self, index):
+        """Forks a dead worker again; main thread only"""
+        with self.revive_lock:
+            if not self._bury(index):
+                return
+            print(f"Restarting worker {index}", file=sys.stderr)
+            self.dead.discard(index)
+            self.restarts += 1
+            self._fork(index)
+
+    def submit(self, request):
+        """
+        Queues a request on the right worker; its reply is sent by the reader
+        thread. Raises ValueError for a request no worker can take.
+        """
+        op = request.get('op', 'analyze')
+        session = request.get('session')
+        if op in main.STREAM_OPS and invalid_session(request):
+            raise ValueError(invalid_session(request)['error'])
+        if op == 'metrics':
+            try:
+                worker = int(request.get('worker', 0))
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid worker: {request.get('worker')!r}")
+
+        with self.lock:
+            least_busy = min(range(len(self.processes)), key=lambda i: len(self.pending[i]))
+            if op == 'stream_open':
+                index = self.sessions[session] = least_busy
+            elif op in ('stream_chunk', 'stream_close'):
+                index = self.sessions.get(session, least_busy)
+                if op == 'stream_close':
+                    self.sessions.pop(session, None)
+            elif op == 'metrics':
+                index = min(max(worker, 0), len(self.processes) - 1)
+            else:
+                index = least_busy
+
+        # Not reforked between queueing and recording it as pending
+        with self.revive_lock:
+            self._revive(index)
+            with self.lock:
+                self.pending[index].append(request.get('id'))
+            self.queues[index].put(request)
+
+    def memory_report(self):
+        return {
+            'parent': memory_usage(os.getpid()),
+            'workers': [
+                {'index': index, 'pid': process.pid, 'alive': process.is_alive(),
+                 'pending': len(self.pending[index]), 'memory': memory_usage(process.pid)}
+                for index, process in enumerate(self.processes)
+            ],
+            'restarts': self.restarts,
+        }
+
+    def stop(self):
+        """Lets every worker finish its queue, then stops the reply reader"""
+        with self.revive_lock:
+            self.stopping = True
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                self.queues[index].put(None)
+        for process in self.processes:
+            process.join()
+        self.responses.put(None)
+        if self.reader is not None:
+            self.reader.join()
@@ -0,0 +1,583 @@
+"""
+Score-equivalence and latency-budget regression harness.
+
+Runs the golden corpus (golden_corpus.jsonl) through the reference path and
+then through every optimized path. The reference path is sequential
+analyze_introduction with the result and grammar caches off, each text
+encoded on its own. Every path, the reference included, must return the
+scores and feedback in golden_expected.json exactly. Those were produced by
+the grader as it was before any optimization (BASELINE_REF), with one
+whole-text LanguageTool check per item, so a change that already altered
+scores fails too. Feedback fields added since (ADDED_FIELDS) are not
+compared with the golden expectations. A criterion with no golden
+expectations fails until they are recorded with --record-golden. Every path
+must also match the reference, including on those added fields.
+The one exception is keyword similarities, which may differ by the mode's
+tolerance: float noise from batched encoding, or quantization error for
+the int8/onnx backends. A KeyWord category that flips still fails.
+The reference pass also times every criterion. Its per-criterion and
+per-request p95 latency and the peak RSS of the run are checked against
+regression_budget.json. An entry missing from the budget fails too.
+
+The checked-in golden_expected.json and regression_budget.json only cover
+the criteria that need neither the sentence model nor LanguageTool. Until
+KeyWord and Error and the full-rubric request and peak RSS budgets are
+recorded, a default run fails. Record them once on a machine with the whole
+stack, then commit both files:
+    python3 regression.py --record-golden --record-criteria KeyWord,Error
+    python3 regression.py --update-budget
+
+Modes:
+    parallel       criteria on the thread pool (GRADER_PARALLEL)
+    batched        analyze_introductions, one encode call per batch
+    cache-memory   second pass served from the in-memory result cache
+    cache-disk     second pass served from the SQLite result cache
+    grammar-cache  second pass with every text's grammar matches cached
+    scheduler      concurrent requests through BatchScheduler micro-batches
+    stream         IncrementalGrader fed in chunks, finished (STREAM_EXACT criteria only)
+    serve, serve-batch, serve-prefork
+                   main.py --serve worker processes over NDJSON
+    serve-int8, serve-onnx
+                   --serve with a quantized backend (not run by default)
+--sentence-embeddings scores differently by design, so it is not a mode here.
+
+Air-gapped runs: --offline makes Hugging Face load models only from the local
+cache (--model-cache), --grammar-url uses an already running LanguageTool
+server and --languagetool-dir a LanguageTool that was downloaded beforehand.
+
+Usage:
+    python3 regression.py --offline --model-cache /opt/models --grammar-url http://localhost:8081
+    python3 regression.py --modes parallel,stream --criteria Salutation,Flow,SpeechRate
+    python3 regression.py --update-budget
+    python3 regression.py --record-golden --record-criteria KeyWord,Error --languagetool-dir /opt/LanguageTool
+Exits with status 1 on any difference from the reference or budget overrun.
+"""
+import argparse
+import asyncio
+from contextlib import contextmanager
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+from bench import percentile, peak_rss_mb
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(HERE, 'golden_corpus.jsonl')
+DEFAULT_BUDGET = os.path.join(HERE, 'regression_budget.json')
+DEFAULT_GOLDEN = os.path.join(HERE, 'golden_expected.json')
+# The grader before the optimization series; golden expectations come from its main.py
+BASELINE_REF = 'fa1b60f'
+# Feedback added after BASELINE_REF, left out of the golden comparison
+ADDED_FIELDS = {'Richness': ('ttr', 'mattr', 'hdd')}
+# Runs the baseline main.py (cwd) on every corpus item read from stdin, one result per line
+BASELINE_DRIVER = """
+import json, sys
+stdout, sys.stdout = sys.stdout, sys.stderr
+import main
+for line in sys.stdin:
+    item = json.loads(line)
+    try:
+        result = main.analyze_introduction(item['introduction'], item['duration'])
+    except Exception as e:
+        result = {'error': str(e)}
+    stdout.write(json.dumps(result) + "\\n")
+    stdout.flush()
+"""
+
+DEFAULT_MODES = ['parallel', 'batched', 'cache-memory', 'cache-disk', 'grammar-cache', 'scheduler', 'stream',
+                 'serve', 'serve-batch', 'serve-prefork']
+SERVE_MODES = {
+    'serve': [],
+    'serve-batch': ['--batch', '--max-batch-size', '8'],
+    'serve-prefork': ['--workers', '2'],
+    'serve-int8': ['--embedding-backend', 'int8'],
+    'serve-onnx': ['--embedding-backend', 'onnx'],
+}
+# Criteria IncrementalGrader.finish() grades exactly like analyze_introduction
+STREAM_EXACT = ['Salutation', 'Flow', 'SpeechRate', 'Richness', 'FillerWordRate', 'Sentiment']
+# Feedback fields that may differ by the mode's tolerance
+TOLERANT_FIELDS = ('similarity',)
+FLOAT_TOLERANCE = 1e-3
+QUANTIZED_TOLERANCE = 0.05
+TOP_LEVEL_FIELDS = ('overallScore', 'totalDuration', 'wordCount', 'speechRate')
+# Recorded budgets never go below this: on a shared CI runner a sub-millisecond
+# step's p95 is mostly scheduler and timer noise
+MIN_BUDGET_MS = 10.0
+# Budget = measured p95 times this, so a slower CI machine still passes
+DEFAULT_HEADROOM = 5.0
+
+
+def configure_environment(args):
+    """Settings for the reference path and offline runs; must happen before main is imported"""
+    os.environ['GRADER_CACHE_SIZE'] = '0'
+    for name in ('GRADER_CACHE_PATH', 'GRADER_STORE_PATH', 'GRADER_PARALLEL', 'GRADER_CRITERION_TIMEOUT',
+                 'GRADER_TIMINGS', 'GRADER_PROFILE_EVERY', 'GRADER_SENTENCE_EMBEDDINGS', 'GRADER_EMBEDDING_BACKEND'):
+        os.environ.pop(name, None)
+    if args.offline:
+        os.environ['HF_HUB_OFFLINE'] = '1'
+        os.environ['TRANSFORMERS_OFFLINE'] = '1'
+    if args.model_cache:
+        os.environ['HF_HOME'] = args.model_cache
+        os.environ['SENTENCE_TRANSFORMERS_HOME'] = args.model_cache
+    if args.grammar_url:
+        os.environ['GRADER_GRAMMAR_URLS'] = args.grammar_url
+    if args.languagetool_dir:
+        os.environ['LTP_PATH'] = args.languagetool_dir
+
+
+def read_corpus(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+@contextmanager
+def settings(module, **values):
+    """Temporarily sets module globals, restoring them afterwards"""
+    previous = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(module, name, value)
+
+
+def analyze(main, item, criteria, include_timings=False):
+    try:
+        return main.analyze_introduction(item['introduction'], item['duration'], criteria=criteria,
+                                         include_timings=include_timings)
+    except Exception as e:
+        return {'error': str(e)}
+
+
+def run_reference(main, corpus, criteria):
+    """Reference results plus {criterion or "request": [wall ms per item]}"""
+    with settings(main, GRAMMAR_CACHE=None):
+        # One untimed pass so lazy initialisation doesn't count as latency
+        analyze(main, corpus[0], criteria)
+        results = [analyze(main, item, criteria, include_timings=True) for item in corpus]
+    latencies = {}
+    for result in results:
+        timings = result.pop('timings', None)
+        if timings is None:
+            continue
+        latencies.setdefault('request', []).append(timings['total']['wall_ms'])
+        for criterion, timing in timings['criteria'].items():
+            latencies.setdefault(criterion, []).append(timing['wall_ms'])
+    return results, latencies
+
+
+def run_parallel(main, corpus, criteria):
+    with settings(main, GRAMMAR_CACHE=None, PARALLEL_GRADING=True, CRITERION_TIMEOUT=None):
+        return [analyze(main, item, criteria) for item in corpus]
+
+
+def run_batched(main, corpus, criteria):
+    with settings(main, GRAMMAR_CACHE=None):
+        return [result for _, result in main.analyze_introductions(corpus, batch_size=8, criteria=criteria)]
+
+
+def run_twice(main, corpus, criteria, stat, **values):
+    """Second-pass results with the given cache in place; fails if the cache was never hit"""
+    with settings(main, **values):
+        for item in corpus:
+            analyze(main, item, criteria)
+        results = [analyze(main, item, criteria) for item in corpus]
+        cache = values.get('RESULT_CACHE') or values.get('GRAMMAR_CACHE')
+        report = cache.report()
+        cache.close()
+    if not report[stat]:
+        raise RuntimeError(f"cache was never hit ({report})")
+    return results
+
+
+def run_cache_memory(main, corpus, criteria):
+    from result_cache import ResultCache
+    return run_twice(main, corpus, criteria, 'memory_hits', GRAMMAR_CACHE=None,
+                     RESULT_CACHE=ResultCache(max_entries=len(corpus) + 1))
+
+
+def run_cache_disk(main, corpus, criteria):
+    from result_cache import ResultCache
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResultCache(max_entries=0, path=os.path.join(directory, 'cache.sqlite'))
+        return run_twice(main, corpus, criteria, 'disk_hits', GRAMMAR_CACHE=None, RESULT_CACHE=cache)
+
+
+def run_grammar_cache(main, corpus, criteria):
+    from result_cache import ResultCache
+    if criteria is not None and 'Error' not in criteria:
+        return None
+    return run_twice(main, corpus, criteria, 'memory_hits', GRAMMAR_CACHE=ResultCache(max_entries=65536))
+
+
+def run_scheduler(main, corpus, criteria):
+    from scheduler import BatchScheduler
+
+    async def grade_all():
+        scheduler = BatchScheduler(
+            lambda text, duration, embedding, timings: main.analyze_introduction(text, duration, embedding, criteria, timings),
+            lambda texts: main.encode_texts(texts, criteria, len(texts)),
+            max_batch_size=8, max_wait_ms=5, max_queue=len(corpus) + 1
+        )
+        await scheduler.start()
+        results = await asyncio.gather(
+            *(scheduler.submit(item['introduction'], item['duration'], False) for item in corpus),
+            return_exceptions=True
+        )
+        await scheduler.stop()
+        return [{'error': str(result)} if isinstance(result, Exception) else result for result in results]
+
+    with settings(main, GRAMMAR_CACHE=None):
+        return asyncio.run(grade_all())
+
+
+def chunks(text, words_per_chunk=7):
+    """text cut at whitespace every few words; the pieces join back to text exactly"""
+    pieces, start, words, in_word = [], 0, 0, False
+    for i, character in enumerate(text):
+        if character.isspace():
+            if in_word:
+                words += 1
+                if words % words_per_chunk == 0:
+                    pieces.append(text[start:i])
+                    start = i
+            in_word = False
+        else:
+            in_word = True
+    pieces.append(text[start:])
+    return [piece for piece in pieces if piece]
+
+
+def run_stream(main, corpus, criteria):
+    from streaming import IncrementalGrader
+
+    enabled = [c for c in STREAM_EXACT if criteria is None or c in criteria]
+    results = []
+    with settings(main, GRAMMAR_CACHE=None):
+        for item in corpus:
+            try:
+                grader = IncrementalGrader(enabled, separator='')
+                pieces = chunks(item['introduction'])
+                for i, piece in enumerate(pieces):
+                    last = i == len(pieces) - 1
+                    grader.feed(piece, item['duration'] if last else item['duration'] * (i + 1) / len(pieces))
+                result = grader.finish()
+                result.pop('streaming')
+            except Exception as e:
+                result = {'error': str(e)}
+            results.append(result)
+    return results, enabled
+
+
+def run_serve(corpus, criteria, extra):
+    """Results from a main.py --serve process with the given extra arguments"""
+    command = [sys.executable, os.path.join(HERE, 'main.py'), '--serve'] + extra
+    if criteria is not None:
+        command += ['--criteria', ','.join(criteria)]
+    requests = [json.dumps({'id': i, 'introduction': item['introduction'], 'duration': item['duration']})
+                for i, item in enumerate(corpus)]
+    requests.append(json.dumps({'id': 'shutdown', 'op': 'shutdown'}))
+    completed = subprocess.run(command, input="\n".join(requests) + "\n", capture_output=True, text=True,
+                               env=dict(os.environ), timeout=3600)
+    replies = {}
+    for line in completed.stdout.splitlines():
+        reply = json.loads(line)
+        if isinstance(reply.get('id'), int):
+            replies[reply['id']] = reply['result'] if reply.get('ok') else {'error': reply.get('error')}
+    missing = [i for i in range(len(corpus)) if i not in replies]
+    if missing:
+        raise RuntimeError(f"no reply for items {missing[:5]} (exit {completed.returncode}): {completed.stderr[-2000:]}")
+    return [replies[i] for i in range(len(corpus))]
+
+
+def comparable(main, result, criteria=None):
+    """Top-level fields and {criterion: metric} of a result, for the given criteria only"""
+    if 'error' in result:
+        return {'error': result['error']}
+    view = {field: result.get(field) for field in TOP_LEVEL_FIELDS}
+    if criteria is not None:
+        # overallScore sums criteria outside the subset
+        del view['overallScore']
+    metrics = {metric['name']: metric for category in result['criteriaScores'] for metric in category['metrics']}
+    for name, criterion in main.CRITERIA.items():
+        if (criteria is None or name in criteria) and criterion.metric in metrics:
+            view[name] = metrics[criterion.metric]
+    return view
+
+
+def differences(expected, actual, tolerance, path=''):
+    """Every path where actual differs from expected"""
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        found = []
+        for key in list(expected) + [key for key in actual if key not in expected]:
+            if key not in actual or key not in expected:
+                found.append(f"{path}.{key}: {'missing' if key not in actual else 'unexpected'}")
+            else:
+                found.extend(differences(expected[key], actual[key], tolerance, f"{path}.{key}"))
+        return found
+    if isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            return [f"{path}: {len(expected)} items != {len(actual)}"]
+        found = []
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            found.extend(differences(e, a, tolerance, f"{path}[{i}]"))
+        return found
+    if is_number(expected) and is_number(actual):
+        if path.rsplit('.', 1)[-1] in TOLERANT_FIELDS:
+            return [] if abs(expected - actual) <= tolerance else [f"{path}: {expected} != {actual} (tolerance {tolerance})"]
+        # 30 and 30.0 are the same duration whichever path produced them
+        return [] if expected == actual else [f"{path}: {expected!r} != {actual!r}"]
+    return [] if expected == actual and type(expected) is type(actual) else [f"{path}: {expected!r} != {actual!r}"]
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def compare(main, corpus, reference, results, tolerance, criteria=None):
+    """{item id: [differences]} for items that differ from the reference"""
+    found = {}
+    for item, expected, actual in zip(corpus, reference, results):
+        diff = differences(comparable(main, expected, criteria), comparable(main, actual, criteria), tolerance)
+        if diff:
+            found[item.get('id')] = diff
+    return found
+
+
+def read_golden(path):
+    if not os.path.exists(path):
+        return {'baseline': None, 'criteria': [], 'items': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def golden_view(main, result, criteria):
+    """comparable() of a result for criteria, without ADDED_FIELDS"""
+    view = comparable(main, result, criteria)
+    for name, fields in ADDED_FIELDS.items():
+        if isinstance(view.get(name, {}).get('details'), dict):
+            details = {key: value for key, value in view[name]['details'].items() if key not in fields}
+            view[name] = dict(view[name], details=details)
+    return view
+
+
+def compare_golden(main, corpus, golden, results, tolerance, criteria):
+    """{item id: [differences]} for items whose criteria differ from the golden expectations"""
+    found = {}
+    for item, actual in zip(corpus, results):
+        expected = golden['items'].get(item.get('id'))
+        if expected is None:
+            found[item.get('id')] = ['no golden expectations for this item']
+            continue
+        expected = {key: value for key, value in expected.items() if key in TOP_LEVEL_FIELDS or key in criteria}
+        if len(criteria) < len(main.WEIGHTS):
+            expected.pop('overallScore', None)
+        diff = differences(expected, golden_view(main, actual, criteria), tolerance)
+        if diff:
+            found[item.get('id')] = diff
+    return found
+
+
+def record_golden(args, corpus):
+    """Grades the corpus with the baseline main.py and merges the chosen criteria into the golden file"""
+    import main
+    from main import parse_criteria
+
+    criteria = parse_criteria(args.record_criteria) or list(main.WEIGHTS)
+    source = subprocess.run(['git', 'show', f'{args.baseline}:backend/python/main.py'], cwd=HERE,
+                            capture_output=True, text=True, check=True).stdout
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'main.py'), 'w', encoding='utf-8') as f:
+            f.write(source)
+        completed = subprocess.run(
+            [sys.executable, '-c', BASELINE_DRIVER], cwd=directory, env=dict(os.environ), capture_output=True,
+            text=True, timeout=3600, input=''.join(json.dumps(item) + "\n" for item in corpus)
+        )
+    results = [json.loads(line) for line in completed.stdout.splitlines()]
+    if completed.returncode or len(results) != len(corpus):
+        raise SystemExit(f"baseline {args.baseline} failed (exit {completed.returncode}): {completed.stderr[-2000:]}")
+    failed = [item['id'] for item, result in zip(corpus, results) if 'error' in result]
+    if failed:
+        raise SystemExit(f"baseline {args.baseline} failed on {failed[:5]}")
+
+    golden = read_golden(args.golden)
+    golden['baseline'] = args.baseline
+    golden['criteria'] = sorted(set(golden['criteria']) | set(criteria))
+    for item, result in zip(corpus, results):
+        view = golden['items'].setdefault(item['id'], {})
+        view.update(golden_view(main, result, criteria))
+        if len(golden['criteria']) < len(main.WEIGHTS):
+            view.pop('overallScore', None)
+    with open(args.golden, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(golden, indent=2, sort_keys=True, ensure_ascii=False) + "\n")
+    print(f"Wrote {args.golden} ({', '.join(criteria)} from {args.baseline})", file=sys.stderr)
+
+
+def degraded_items(corpus, results):
+    return [
+        item.get('id') for item, result in zip(corpus, results)
+        if any(metric['details'].get('degraded') for category in result.get('criteriaScores', [])
+               for metric in category['metrics'])
+    ]
+
+
+def check_budget(latencies, peak_rss, budget, full_rubric):
+    """(p95 latency and peak RSS measurements, overruns and missing budget entries)"""
+    measured = {name: round(percentile(values, 0.95), 3) for name, values in latencies.items()}
+    overruns = []
+    limits = budget.get('latency_p95_ms', {})
+    # A subset run's request time and memory say nothing about the whole rubric's
+    checked = [name for name in measured if name != 'request' or full_rubric]
+    for name in checked:
+        if name not in limits:
+            overruns.append(f"{name}: no latency budget (record one with --update-budget)")
+        elif measured[name] > limits[name]:
+            overruns.append(f"{name}: p95 {measured[name]} ms > budget {limits[name]} ms")
+    if full_rubric and budget.get('peak_rss_mb') is None:
+        overruns.append("no peak RSS budget (record one with --update-budget)")
+    elif full_rubric and peak_rss > budget['peak_rss_mb']:
+        overruns.append(f"peak RSS {peak_rss} MB > budget {budget['peak_rss_mb']} MB")
+    return {'latency_p95_ms': measured, 'peak_rss_mb': peak_rss}, overruns
+
+
+def update_budget(path, budget, measured, full_rubric, headroom):
+    limits = budget.setdefault('latency_p95_ms', {})
+    for name, value in measured['latency_p95_ms'].items():
+        if name != 'request' or full_rubric:
+            limits[name] = max(math.ceil(value * headroom * 10) / 10, MIN_BUDGET_MS)
+    if full_rubric:
+        budget['peak_rss_mb'] = round(measured['peak_rss_mb'] * 1.25, 1)
+    budget['headroom'] = headroom
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(budget, indent=2, sort_keys=True) + "\n")
+
+
+def run(args):
+    configure_environment(args)
+    import main
+    from main import parse_criteria
+
+    criteria = parse_criteria(args.criteria)
+    corpus = read_corpus(args.corpus)
+    if args.record_golden:
+        record_golden(args, corpus)
+        return {'config': {'corpus': args.corpus, 'golden': args.golden}, 'failures': []}
+    modes = parse_criteria(args.modes) if args.modes else DEFAULT_MODES
+    unknown = [mode for mode in modes if mode not in SERVE_MODES and f'run_{mode.replace("-", "_")}' not in globals()]
+    if unknown:
+        raise SystemExit(f"Unknown modes: {', '.join(unknown)}")
+
+    main.warmup(criteria)
+    print(f"Reference pass over {len(corpus)} items...", file=sys.stderr)
+    reference, latencies = run_reference(main, corpus, criteria)
+    report = {'config': {'corpus': args.corpus, 'items': len(corpus), 'criteria': criteria, 'modes': modes},
+              'modes': {}, 'failures': []}
+    degraded = degraded_items(corpus, reference)
+    if degraded:
+        report['failures'].append(f"reference: degraded results for {degraded[:5]} (is LanguageTool reachable?)")
+
+    golden = read_golden(args.golden)
+    enabled = [name for name in main.WEIGHTS if criteria is None or name in criteria]
+    unrecorded = [name for name in enabled if name not in golden['criteria']]
+    if unrecorded:
+        report['failures'].append(
+            f"no golden expectations for {', '.join(unrecorded)} in {args.golden}; record them from "
+            f"{BASELINE_REF} with --record-golden --record-criteria {','.join(unrecorded)}"
+        )
+    report['golden'] = {'baseline': golden['baseline'], 'unrecorded': unrecorded}
+
+    def check_golden(mode, results, compared):
+        compared = [name for name in (compared or enabled) if name in golden['criteria']]
+        found = compare_golden(main, corpus, golden, results, args.tolerance, compared)
+        if found:
+            report['failures'].append(f"{mode}: {len(found)} items differ from the golden expectations")
+        return found
+
+    report['golden']['differences'] = check_golden('reference', reference, criteria)
+
+    for mode in modes:
+        print(f"Checking {mode}...", file=sys.stderr)
+        tolerance = args.quantized_tolerance if mode in ('serve-int8', 'serve-onnx') else args.tolerance
+        compared = criteria
+        try:
+            if mode in SERVE_MODES:
+                results = run_serve(corpus, criteria, SERVE_MODES[mode])
+            elif mode == 'stream':
+                results, compared = run_stream(main, corpus, criteria)
+            else:
+                results = globals()[f'run_{mode.replace("-", "_")}'](main, corpus, criteria)
+        except Exception as e:
+            report['modes'][mode] = {'error': str(e)}
+            report['failures'].append(f"{mode}: {e}")
+            continue
+        if results is None:
+            report['modes'][mode] = {'skipped': 'not applicable to these criteria'}
+            continue
+        found = compare(main, corpus, reference, results, tolerance, compared)
+        report['modes'][mode] = {'items': len(results), 'criteria': compared, 'tolerance': tolerance,
+                                 'differing_items': len(found), 'differences': found,
+                                 'golden_differences': check_golden(mode, results, compared)}
+        if found:
+            report['failures'].append(f"{mode}: {len(found)} items differ from the reference")
+
+    full_rubric = criteria is None
+    peak_rss = max(peak_rss_mb(), round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1))
+    budget = {}
+    if os.path.exists(args.budget):
+        with open(args.budget, encoding='utf-8') as f:
+            budget = json.load(f)
+    measured, overruns = check_budget(latencies, peak_rss, budget, full_rubric)
+    report['budget'] = dict(measured, overruns=overruns)
+    if args.update_budget:
+        update_budget(args.budget, budget, measured, full_rubric, args.headroom)
+        print(f"Wrote {args.budget}", file=sys.stderr)
+    else:
+        report['failures'].extend(overruns)
+    return report
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Check optimized grading paths against the reference path')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help='Golden corpus (.jsonl of id/introduction/duration)')
+    parser.add_argument('--budget', default=DEFAULT_BUDGET, help='Latency/memory budget JSON')
+    parser.add_argument('--modes', help=f"Comma-separated modes (default: {','.join(DEFAULT_MODES)})")
+    parser.add_argument('--criteria', help='Comma-separated rubric subset')
+    parser.add_argument('--tolerance', type=float, default=FLOAT_TOLERANCE, help='Allowed keyword similarity drift')
+    parser.add_argument('--quantized-tolerance', type=float, default=QUANTIZED_TOLERANCE,
+                        help='Allowed keyword similarity drift for the int8/onnx backends')
+    parser.add_argument('--offline', action='store_true', help='Load models from the local Hugging Face cache only')
+    parser.add_argument('--model-cache', help='Directory holding the cached sentence model')
+    parser.add_argument('--grammar-url', help='Comma-separated URLs of running LanguageTool servers')
+    parser.add_argument('--languagetool-dir', help='Directory of a downloaded LanguageTool (LTP_PATH)')
+    parser.add_argument('--update-budget', action='store_true',
+                        help='Record the measured latencies (times --headroom) as the new budget instead of checking')
+    parser.add_argument('--headroom', type=float, default=DEFAULT_HEADROOM, help='Budget = measured p95 times this')
+    parser.add_argument('--golden', default=DEFAULT_GOLDEN, help='Expected scores and feedback per corpus item')
+    parser.add_argument('--record-golden', action='store_true',
+                        help='Grade the corpus with the baseline main.py and write its results to --golden')
+    parser.add_argument('--record-criteria', help='Comma-separated criteria to record (default: all)')
+    parser.add_argument('--baseline', default=BASELINE_REF, help='Git revision of the baseline main.py')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    report = run(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if report['failures']:
+        for failure in report['failures']:
+            print(f"FAIL {failure}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,134 @@
+"""
+Bulk rescoring of stored introductions.
+
+Reads submissions from a JSONL or CSV file (fields: introduction, duration and
+an optional id) and writes one JSON line per submission:
+    {"index": 0, "id": ..., "result": {...}}
+
+With --store, every result is also appended to a result store (see
+result_store.py) as a bulk write, which a running grader can keep writing to.
+
+Texts are encoded a batch at a time, so keyword similarities can differ from
+the single-request grader's by about 1e-3 and a keyword category right at the
+threshold can flip. --exact encodes each text on its own and reproduces the
+single-request scores exactly, at single-request speed.
+
+Usage:
+    python3 rescore.py submissions.jsonl results.jsonl --batch-size 64
+    python3 rescore.py submissions.csv results.jsonl --resume
+    python3 rescore.py submissions.jsonl results.jsonl --store results.sqlite
+    python3 rescore.py submissions.jsonl results.jsonl --exact
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+from main import analyze_introductions
+from result_store import ResultStore
+
+
+def read_submissions(path):
+    """Lazily yields submission dicts from a .jsonl or .csv file"""
+    if path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                try:
+                    row['duration'] = float(row['duration'])
+                except (KeyError, TypeError, ValueError):
+                    pass
+                yield row
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield {"error": f"Invalid JSON: {str(e)}"}
+
+
+def next_index(path):
+    """Index after the last complete line of an earlier (possibly crashed) run"""
+    if not os.path.exists(path):
+        return 0
+    last = -1
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                last = json.loads(line)['index']
+            except (json.JSONDecodeError, KeyError, TypeError):
+                # A partially written last line is simply graded again
+                continue
+    return last + 1
+
+
+def ends_with_newline(path):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return True
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rescore stored introductions in bulk')
+    parser.add_argument('input', help='Input .jsonl or .csv file')
+    parser.add_argument('output', help='Output .jsonl file')
+    parser.add_argument('--batch-size', type=int, default=32, help='Texts per embedding batch')
+    parser.add_argument('--start', type=int, default=0, help='Skip this many input items')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue after the items already present in the output file')
+    parser.add_argument('--store', help='Also append every result to this SQLite result store')
+    parser.add_argument('--exact', action='store_true',
+                        help='Encode texts one at a time so scores match the single-request grader exactly')
+    args = parser.parse_args()
+
+    start = args.start
+    mode = 'w'
+    if args.resume:
+        start = max(start, next_index(args.output))
+        mode = 'a'
+    print(f"Rescoring {args.input} from item {start}...", file=sys.stderr)
+
+    submissions = read_submissions(args.input)
+    # Keep ids (and inputs, for the store) alongside results without holding the whole input in memory
+    ids = {}
+    inputs = {}
+    store = ResultStore(args.store) if args.store else None
+
+    def with_ids(items):
+        for index, item in enumerate(items):
+            if index >= start:
+                ids[index] = item.get('id') if isinstance(item, dict) else None
+                if store is not None and isinstance(item, dict):
+                    inputs[index] = (item.get('introduction'), item.get('duration'))
+            yield item
+
+    count = 0
+    if mode == 'a' and not ends_with_newline(args.output):
+        # Don't glue new results onto a line cut short by a crash
+        with open(args.output, 'a', encoding='utf-8') as out:
+            out.write("\n")
+
+    with open(args.output, mode, encoding='utf-8') as out:
+        for index, result in analyze_introductions(with_ids(submissions), args.batch_size, start, exact=args.exact):
+            submission_id = ids.pop(index, None)
+            out.write(json.dumps({"index": index, "id": submission_id, "result": result}) + "\n")
+            out.flush()
+            text, duration = inputs.pop(index, (None, None))
+            if store is not None and 'error' not in result and isinstance(text, str):
+                store.record(result, text, duration, submission_id, source='rescore', bulk=True)
+            count += 1
+
+    if store is not None:
+        store.close()
+
+    print(f"Rescored {count} introductions", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
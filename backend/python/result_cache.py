@@ -0,0 +1,135 @@
+"""
+Content-addressed cache for grading results.
+
+Results are stored as JSON under a key computed by the caller (see
+main.result_cache_key). A bounded in-memory LRU sits in front of an optional
+SQLite file with TTL and size-based eviction. Every lookup returns a fresh
+copy, so callers can mutate results freely.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def content_key(*parts):
+    """sha256 over the JSON encoding of parts"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_entries=1024, path=None, ttl=None, max_disk_entries=100000):
+        """
+        max_entries: size of the in-memory LRU (0 disables it)
+        path: SQLite file for the on-disk tier (None disables it)
+        ttl: seconds a disk entry stays valid (None = forever)
+        max_disk_entries: least recently used disk entries beyond this are evicted
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {
+            'memory_hits': 0, 'disk_hits': 0, 'misses': 0,
+            'memory_evictions': 0, 'disk_evictions': 0, 'expired': 0, 'puts': 0
+        }
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+            self.db.commit()
+
+    def get(self, key):
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return json.loads(value)
+
+            if self.db is not None:
+                row = self.db.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, created = row
+                    now = time.time()
+                    if self.ttl is not None and now - created > self.ttl:
+                        self.db.execute("DELETE FROM results WHERE key = ?", (key,))
+                        self.db.commit()
+                        self.stats['expired'] += 1
+                    else:
+                        self.db.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+                        self.db.commit()
+                        self._remember(key, value)
+                        self.stats['disk_hits'] += 1
+                        return json.loads(value)
+
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, key, result):
+        value = json.dumps(result)
+        with self.lock:
+            self.stats['puts'] += 1
+            self._remember(key, value)
+
+            if self.db is not None:
+                now = time.time()
+                self.db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+                self._evict_disk(now)
+                self.db.commit()
+
+    def _remember(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.stats['memory_evictions'] += 1
+
+    def _evict_disk(self, now):
+        if self.ttl is not None:
+            expired = self.db.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,)).rowcount
+            self.stats['expired'] += expired
+
+        count = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if count > self.max_disk_entries:
+            evicted = self.db.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed LIMIT ?)",
+                (count - self.max_disk_entries,)
+            ).rowcount
+            self.stats['disk_evictions'] += evicted
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM results")
+                self.db.commit()
+
+    def report(self):
+        with self.lock:
+            report = dict(self.stats)
+            report['memory_entries'] = len(self.memory)
+            if self.db is not None:
+                report['disk_entries'] = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            lookups = report['memory_hits'] + report['disk_hits'] + report['misses']
+            report['hit_rate'] = round((report['memory_hits'] + report['disk_hits']) / lookups, 4) if lookups else 0
+            return report
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
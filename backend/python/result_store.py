@@ -0,0 +1,242 @@
+"""
+Embedded store of grading results.
+
+Every graded submission is appended to a SQLite table in WAL mode, indexed by
+submission id, text hash and creation time, so results survive restarts and
+can be looked up without scanning. Rescoring appends new rows rather than
+replacing old ones; get() returns the latest row of a submission.
+
+Writes never happen on the caller's thread. record() queues the row and one
+writer thread commits queued rows in batches (every batch_size rows or
+flush_interval seconds), so rows can be lost if the process is killed before
+they are committed. Bulk rows (record(..., bulk=True), used by rescoring) wait
+in a bounded queue and are committed bulk_chunk at a time. Each chunk is its
+own short transaction and online rows go first, so a rescoring run never holds
+the write lock for long, whether it writes through this process or from a
+separate one.
+
+Reads use one connection per thread. Under WAL they run concurrently with the
+writer and see committed rows only.
+"""
+from collections import deque
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS results ("
+    "id INTEGER PRIMARY KEY, submission_id TEXT, text_hash TEXT NOT NULL, created REAL NOT NULL, "
+    "source TEXT NOT NULL, introduction TEXT, duration REAL, overall_score REAL, result TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS results_submission ON results (submission_id, created)",
+    "CREATE INDEX IF NOT EXISTS results_text_hash ON results (text_hash)",
+    "CREATE INDEX IF NOT EXISTS results_created ON results (created, id)",
+]
+COLUMNS = 'id, submission_id, text_hash, created, source, introduction, duration, overall_score, result'
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def to_record(row):
+    """A results row as a protocol-ready dict"""
+    row_id, submission_id, hashed, created, source, introduction, duration, overall_score, result = row
+    return {
+        'id': row_id,
+        'submissionId': submission_id,
+        'textHash': hashed,
+        'created': created,
+        'source': source,
+        'introduction': introduction,
+        'duration': duration,
+        'overallScore': overall_score,
+        'result': json.loads(result),
+    }
+
+
+class ResultStore:
+    def __init__(self, path, batch_size=64, flush_interval=0.5, bulk_chunk=256, busy_timeout=5):
+        """
+        path: SQLite file (created if missing)
+        batch_size: online rows per commit
+        flush_interval: seconds an online row may wait for its batch to fill
+        bulk_chunk: bulk rows per transaction; the bulk queue holds 4 chunks
+        busy_timeout: seconds a statement waits for another connection's write lock
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.bulk_chunk = bulk_chunk
+        self.busy_timeout = busy_timeout
+        self.online = deque()
+        self.bulk = deque()
+        self.unwritten = 0
+        self.condition = threading.Condition()
+        self.flushing = False
+        self.closing = False
+        self.local = threading.local()
+        self.stats = {'records': 0, 'bulk_records': 0, 'commits': 0, 'failed': 0}
+
+        db = self._connect()
+        db.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            db.execute(statement)
+        db.commit()
+        db.close()
+
+        self.writer = threading.Thread(target=self._write_loop, daemon=True, name='result-store')
+        self.writer.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=self.busy_timeout)
+        # WAL keeps durability across process crashes without an fsync per commit
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def record(self, result, text, duration, submission_id=None, source='online', bulk=False):
+        """Queues one result; bulk records block while the bulk queue is full"""
+        result = {key: value for key, value in result.items() if key != 'timings'}
+        row = (
+            None if submission_id is None else str(submission_id), text_hash(text), time.time(), source,
+            text, duration, result.get('overallScore'), json.dumps(result)
+        )
+        with self.condition:
+            if self.closing:
+                raise RuntimeError("Result store is closed")
+            if bulk:
+                self.condition.wait_for(lambda: len(self.bulk) < 4 * self.bulk_chunk or self.closing)
+                if self.closing:
+                    raise RuntimeError("Result store is closed")
+                self.bulk.append(row)
+                self.stats['bulk_records'] += 1
+            else:
+                self.online.append(row)
+                self.stats['records'] += 1
+            self.unwritten += 1
+            self.condition.notify_all()
+
+    def _write_loop(self):
+        db = self._connect()
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.online or self.bulk or self.closing)
+                if len(self.online) < self.batch_size and not (self.bulk or self.flushing or self.closing):
+                    # Let a batch build up
+                    self.condition.wait_for(
+                        lambda: len(self.online) >= self.batch_size or self.flushing or self.closing,
+                        timeout=self.flush_interval
+                    )
+                online = list(self.online)
+                self.online.clear()
+                bulk = [self.bulk.popleft() for _ in range(min(len(self.bulk), self.bulk_chunk))]
+                done = self.closing and not self.bulk
+                # Bulk producers may be waiting for room
+                self.condition.notify_all()
+
+            for rows in (online, bulk):
+                if rows:
+                    self._insert(db, rows)
+            with self.condition:
+                self.unwritten -= len(online) + len(bulk)
+                self.condition.notify_all()
+            if done and not self.online:
+                break
+        db.close()
+
+    def _insert(self, db, rows):
+        try:
+            with db:
+                db.executemany(
+                    "INSERT INTO results (submission_id, text_hash, created, source, introduction, duration, "
+                    "overall_score, result) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+                )
+            with self.condition:
+                self.stats['commits'] += 1
+        except sqlite3.Error as e:
+            print(f"Result store failed to write {len(rows)} rows: {e}", file=sys.stderr)
+            with self.condition:
+                self.stats['failed'] += len(rows)
+
+    def flush(self):
+        """Blocks until every queued row is committed (or failed)"""
+        with self.condition:
+            self.flushing = True
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: self.unwritten == 0)
+            self.flushing = False
+
+    def _reader(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = self._connect()
+        return db
+
+    def get(self, submission_id):
+        """Latest record of a submission, None if it has none"""
+        row = self._reader().execute(
+            f"SELECT {COLUMNS} FROM results WHERE submission_id = ? ORDER BY created DESC, id DESC LIMIT 1",
+            (str(submission_id),)
+        ).fetchone()
+        return to_record(row) if row is not None else None
+
+    def versions(self, submission_id):
+        """Every record of a submission, oldest first"""
+        rows = self._reader().execute(
+            f"SELECT {COLUMNS} FROM results WHERE submission_id = ? ORDER BY created, id", (str(submission_id),)
+        ).fetchall()
+        return [to_record(row) for row in rows]
+
+    def find_text(self, text, limit=10):
+        """Newest records graded from exactly this text"""
+        rows = self._reader().execute(
+            f"SELECT {COLUMNS} FROM results WHERE text_hash = ? ORDER BY id DESC LIMIT ?", (text_hash(text), limit)
+        ).fetchall()
+        return [to_record(row) for row in rows]
+
+    def recent(self, limit=20):
+        return self.history(limit=limit)[0]
+
+    def history(self, before=None, limit=100):
+        """
+        One page of records, newest first. before is the cursor returned with
+        the previous page; returns (records, cursor for the next page or None).
+        """
+        if before is None:
+            rows = self._reader().execute(
+                f"SELECT {COLUMNS} FROM results ORDER BY created DESC, id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        else:
+            created, row_id = before
+            rows = self._reader().execute(
+                f"SELECT {COLUMNS} FROM results WHERE (created, id) < (?, ?) ORDER BY created DESC, id DESC LIMIT ?",
+                (created, row_id, limit)
+            ).fetchall()
+        records = [to_record(row) for row in rows]
+        cursor = [records[-1]['created'], records[-1]['id']] if len(records) == limit else None
+        return records, cursor
+
+    def count(self):
+        return self._reader().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def report(self):
+        with self.condition:
+            report = dict(self.stats)
+            report['pending'] = self.unwritten
+        report['rows'] = self.count()
+        return report
+
+    def close(self):
+        """Commits everything queued, then stops the writer"""
+        with self.condition:
+            if self.closing:
+                return
+            self.closing = True
+            self.condition.notify_all()
+        self.writer.join()
+        db = getattr(self.local, 'db', None)
+        if db is not None:
+            db.close()
+            self.local.db = None
@@ -0,0 +1,137 @@
+"""
+Dynamic micro-batching for concurrent grading requests.
+
+Requests submitted while a batch is being collected are grouped (up to
+max_batch_size, or whatever arrived within max_wait_ms of the first one), their
+texts are encoded by the sentence model in one call, and each request is then
+graded with its precomputed embedding. The queue is bounded: when it is full,
+submit() raises QueueFull so callers can answer 429 instead of piling up work.
+"""
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    pass
+
+
+class BatchScheduler:
+    def __init__(self, analyze, encode, max_batch_size=32, max_wait_ms=10, max_queue=256,
+                 workers=4, max_inflight_batches=2):
+        """
+        analyze(text, duration, embedding, options) grades one item; encode(texts) returns
+        one embedding (or None) per text. Both run on the scheduler's thread pool.
+        """
+        self.analyze = analyze
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.max_inflight_batches = max_inflight_batches
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='grader')
+        self.queue = None
+        self.slots = None
+        self.task = None
+        self.metrics = {
+            'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0,
+            'batches': 0, 'batched_items': 0, 'max_batch_size_seen': 0,
+            'max_queue_depth_seen': 0, 'total_queue_wait': 0.0
+        }
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.slots = asyncio.Semaphore(self.max_inflight_batches)
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Grades everything already queued, then stops"""
+        if self.task is None:
+            return
+        await self.queue.join()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, text, duration, options=None):
+        """
+        Grades one introduction; options is passed through to analyze.
+        Raises QueueFull when the queue is at capacity.
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((text, duration, options, time.perf_counter(), future))
+        except asyncio.QueueFull:
+            self.metrics['rejected'] += 1
+            raise QueueFull(f"Grading queue is full ({self.max_queue} pending requests)")
+        self.metrics['submitted'] += 1
+        self.metrics['max_queue_depth_seen'] = max(self.metrics['max_queue_depth_seen'], self.queue.qsize())
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # The next batch is collected while this one is graded, up to max_inflight_batches
+            await self.slots.acquire()
+            loop.create_task(self._process(loop, batch))
+
+    async def _process(self, loop, batch):
+        try:
+            started = time.perf_counter()
+            self.metrics['batches'] += 1
+            self.metrics['batched_items'] += len(batch)
+            self.metrics['max_batch_size_seen'] = max(self.metrics['max_batch_size_seen'], len(batch))
+            self.metrics['total_queue_wait'] += sum(started - queued for _, _, _, queued, _ in batch)
+
+            try:
+                embeddings = await loop.run_in_executor(self.executor, self.encode, [text for text, _, _, _, _ in batch])
+            except Exception as e:
+                print(f"Batch encode error: {e}", file=sys.stderr)
+                embeddings = [None] * len(batch)
+
+            # Items are graded concurrently and resolved as soon as each finishes
+            await asyncio.gather(*[
+                self._grade(loop, text, duration, embedding, options, future)
+                for (text, duration, options, _, future), embedding in zip(batch, embeddings)
+            ])
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+            self.slots.release()
+
+    async def _grade(self, loop, text, duration, embedding, options, future):
+        try:
+            result = await loop.run_in_executor(self.executor, self.analyze, text, duration, embedding, options)
+            self.metrics['completed'] += 1
+            if not future.cancelled():
+                future.set_result(result)
+        except Exception as e:
+            self.metrics['failed'] += 1
+            if not future.cancelled():
+                future.set_exception(e)
+
+    def report(self):
+        metrics = dict(self.metrics)
+        metrics['queue_depth'] = self.queue.qsize() if self.queue is not None else 0
+        metrics['avg_batch_size'] = round(metrics['batched_items'] / metrics['batches'], 2) if metrics['batches'] else 0
+        metrics['avg_queue_wait_ms'] = round(1000 * metrics.pop('total_queue_wait') / metrics['batched_items'], 2) if metrics['batched_items'] else 0
+        return metrics
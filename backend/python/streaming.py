@@ -0,0 +1,246 @@
+"""
+Incremental grading of a transcript that arrives in chunks (live practice).
+
+IncrementalGrader.feed() appends a recognizer segment and returns a score
+snapshot in the analyze_introduction layout. Text is split at the last sentence
+delimiter: everything before it is "completed" and folded into running state
+once, the rest is the pending tail and is re-read on every chunk (it is at most
+one sentence). Since no rubric phrase or word spans a delimiter, word counts,
+salutation, filler, positive-word and flow-section state are the same as over
+the whole text. Grammar, keyword embeddings and MTLD only see completed
+sentences:
+  - grammar matches are summed over completed blocks, so errors LanguageTool
+    only finds across block boundaries are not counted;
+  - KeyWord scores the word-weighted mean of sentence embeddings instead of one
+    embedding of the whole text.
+Richness is not incremental: MTLD's backward pass and HD-D are walks over the
+whole transcript so far. Completed words are only appended (O(1) each), and
+Richness is computed when a snapshot asks for it (feed(..., richness=True))
+and at finish(); other snapshots leave it out.
+finish(exact=True) grades the full transcript with analyze_introduction when the
+authoritative result is needed.
+"""
+import sys
+
+from grammar_pool import GrammarUnavailable
+from instrumentation import METRICS, timed
+from lexical_diversity import LexicalDiversity
+from main import (
+    SENTENCE_DELIMITER, WEIGHTS, FILLER_WORDS, SALUTATION_MATCHER, FILLER_MATCHER,
+    Document, analyze_introduction, build_result, error_result, filler_result,
+    find_positive_words, first_sections, flow_feedback, flow_order_result, get_grammar_error_count,
+    get_keyword_grader, keyword_result, rank_salutation, richness_result,
+    salutation_result, sentiment_result, speech_rate_result, unavailable_feedback,
+)
+
+# Sample errors / positive words kept for feedback, as in the one-shot grader
+MAX_ERROR_DETAILS = 5
+MAX_POSITIVE_WORDS = 10
+
+
+class IncrementalGrader:
+    def __init__(self, criteria=None, separator=' '):
+        """
+        criteria restricts grading as in analyze_introduction. separator is put
+        between chunks unless one side already ends/starts with whitespace.
+        """
+        self.criteria = set(WEIGHTS) if criteria is None else {c for c in criteria if c in WEIGHTS}
+        self.separator = separator
+        self.chunks = []
+        self.tail = ''
+        self.duration = 0
+
+        # State of the completed text
+        self.words = 0
+        self.salutations = set()
+        self.fillers = set()
+        self.tokens = 0
+        self.positive_count = 0
+        self.positive_words = []
+        self.sentence_count = 0
+        self.sections = {}
+        self.error_count = 0
+        self.error_details = []
+        self.grammar_unavailable = None
+        self.embedding_sum = None
+        self.embedded_words = 0
+        self.diversity = LexicalDiversity()
+
+    def feed(self, text, timestamp=None, richness=False):
+        """
+        Appends a segment; timestamp is the end of the segment in seconds from
+        the start of the session. Returns the updated snapshot, with Richness
+        only when richness is set.
+        """
+        with timed('stream.chunk'):
+            if self.chunks and self.separator and text and not text[:1].isspace() and not self.chunks[-1][-1:].isspace():
+                text = self.separator + text
+            if text:
+                self.chunks.append(text)
+            if timestamp is not None:
+                self.duration = max(self.duration, float(timestamp))
+
+            pending = self.tail + text
+            end = 0
+            for delimiter in SENTENCE_DELIMITER.finditer(pending):
+                end = delimiter.end()
+            if end:
+                self.complete(pending[:end])
+            self.tail = pending[end:]
+            METRICS.increment('stream_chunks')
+            return self.snapshot(richness=richness)
+
+    def finish(self, exact=False):
+        """
+        Closes the session: the pending tail counts as a completed sentence.
+        With exact, returns analyze_introduction over the whole transcript instead.
+        """
+        if exact:
+            return analyze_introduction(''.join(self.chunks), self.duration, criteria=sorted(self.criteria))
+        if self.tail.strip():
+            self.complete(self.tail)
+        self.tail = ''
+        return self.snapshot(final=True)
+
+    def complete(self, block):
+        """Folds newly completed text into the running state"""
+        doc = Document(block)
+        # A split-word can continue from the previous block when nothing separates them
+        joined = self.words and doc.words and not block[:1].isspace()
+        self.words += doc.word_count - (1 if joined else 0)
+        self.salutations.update(SALUTATION_MATCHER.scan(doc.lowered))
+        self.fillers.update(FILLER_MATCHER.scan(doc.lowered))
+
+        sentences = doc.sentences
+        first_sections(doc.sections, self.sentence_count, self.sections)
+        self.sentence_count += len(sentences)
+
+        if 'Sentiment' in self.criteria:
+            positive = find_positive_words(doc.tokens)
+            self.tokens += len(doc.tokens)
+            self.positive_count += len(positive)
+            self.positive_words.extend(positive[:MAX_POSITIVE_WORDS - len(self.positive_words)])
+
+        if 'Error' in self.criteria and block.strip():
+            try:
+                count, details = get_grammar_error_count(block.strip())
+                self.error_count += count
+                self.error_details.extend(details[:MAX_ERROR_DETAILS - len(self.error_details)])
+            except GrammarUnavailable as e:
+                # Once a block is missed the running count is incomplete for the rest of the session
+                self.grammar_unavailable = e
+
+        if 'KeyWord' in self.criteria and sentences:
+            keyword_grader = get_keyword_grader()
+            with timed('step.text_encode'):
+                embeddings = keyword_grader.model.encode(
+                    [sentence.lower() for sentence in sentences],
+                    convert_to_tensor=True, normalize_embeddings=True
+                )
+            for sentence, embedding in zip(sentences, embeddings):
+                weighted = embedding * len(sentence.split())
+                self.embedding_sum = weighted if self.embedding_sum is None else self.embedding_sum + weighted
+            self.embedded_words += sum(len(sentence.split()) for sentence in sentences)
+
+        if 'Richness' in self.criteria:
+            # Blocks end in a delimiter, which the tokenizer treats as a word break
+            self.diversity.extend(doc.lexical_tokens)
+
+    def snapshot(self, final=False, richness=False):
+        """
+        Current scores in the analyze_introduction layout plus a "streaming"
+        block. Richness (a pass over every completed word) is graded only with
+        richness or final.
+        """
+        tail = Document(self.tail)
+        lowered = tail.lowered
+        joined = self.words and tail.words and not self.tail[:1].isspace()
+        words = self.words + tail.word_count - (1 if joined else 0)
+
+        tail_sentences = tail.sentences
+        sections = first_sections(tail.sections, self.sentence_count, dict(self.sections))
+
+        scores = {}
+        feedback = {}
+
+        def record(criterion, result):
+            scores[criterion], feedback[criterion] = result
+
+        if 'Salutation' in self.criteria:
+            found = self.salutations.union(SALUTATION_MATCHER.scan(lowered))
+            record('Salutation', salutation_result(*rank_salutation(found)))
+        if 'Flow' in self.criteria:
+            record('Flow', flow_feedback(flow_order_result(self.sentence_count + len(tail_sentences), sections)))
+        if 'SpeechRate' in self.criteria and self.duration > 0:
+            record('SpeechRate', speech_rate_result(words/(self.duration/60)))
+        if 'FillerWordRate' in self.criteria and words:
+            found = self.fillers.union(FILLER_MATCHER.scan(lowered))
+            record('FillerWordRate', filler_result([word for word in FILLER_WORDS if word in found], words))
+        if 'Sentiment' in self.criteria:
+            positive = find_positive_words(tail.tokens)
+            total = self.tokens + len(tail.tokens)
+            positive_words = (self.positive_words + positive)[:MAX_POSITIVE_WORDS]
+            prob = round((self.positive_count + len(positive)) / (total if total else 1), 4)
+            record('Sentiment', sentiment_result(prob, positive_words))
+        if 'Error' in self.criteria and self.grammar_unavailable is not None:
+            record('Error', (0, unavailable_feedback('Error', self.grammar_unavailable)))
+        elif 'Error' in self.criteria and words:
+            record('Error', error_result(self.error_count, words, self.error_details))
+        if 'Richness' in self.criteria and (richness or final) and self.diversity.words:
+            with timed('step.mtld'):
+                record('Richness', richness_result(self.diversity.mtld()/100, self.diversity.report()))
+        if 'KeyWord' in self.criteria and self.embedding_sum is not None:
+            keyword_grader = get_keyword_grader()
+            mean = self.embedding_sum / self.embedded_words
+            record('KeyWord', keyword_result(
+                keyword_grader, *keyword_grader.score_embedding(mean / mean.norm()), WEIGHTS['KeyWord']
+            ))
+
+        result = build_result(scores, feedback, self.duration, words)
+        result["streaming"] = {
+            'final': final,
+            'chunks': len(self.chunks),
+            'completedSentences': self.sentence_count,
+            'pendingText': self.tail,
+        }
+        return result
+
+
+def invalid_session(request):
+    """The error reply when request["session"] cannot key a session, else None"""
+    session = request.get('session')
+    if isinstance(session, (str, int)) and not isinstance(session, bool):
+        return None
+    return {"id": request.get('id'), "ok": False, "error": "session must be a string or an integer"}
+
+
+def handle_stream(request, sessions, criteria=None):
+    """
+    Worker ops for live sessions, keyed by request["session"]:
+    stream_open, stream_chunk {"text", "timestamp", "richness"} and
+    stream_close {"exact"}.
+    Chunk and close replies carry the snapshot as "result".
+    """
+    request_id = request.get('id')
+    op = request.get('op')
+    session = request.get('session')
+    error = invalid_session(request)
+    if error:
+        return error
+    try:
+        if op == 'stream_open':
+            sessions[session] = IncrementalGrader(request.get('criteria') or criteria)
+            return {"id": request_id, "ok": True, "event": "stream_open", "session": session}
+
+        grader = sessions.get(session)
+        if grader is None:
+            return {"id": request_id, "ok": False, "error": f"Unknown stream session: {session}"}
+        if op == 'stream_chunk':
+            result = grader.feed(request.get('text', ''), request.get('timestamp'), request.get('richness', False))
+        else:
+            del sessions[session]
+            result = grader.finish(exact=request.get('exact', False))
+        return {"id": request_id, "ok": True, "event": op, "session": session, "result": result}
+    except Exception as e:
+        print(f"Error in stream {session}: {str(e)}", file=sys.stderr)
+        return {"id": request_id, "ok": False, "error": str(e)}
@@ -2,6 +2,7 @@ const express = require('express');
 const { spawn } = require('child_process');
 const path = require('path');
 const cors = require('cors');
+const readline = require('readline');
 
 const app = express();
 const PORT = process.env.PORT || 5000;
@@ -16,6 +17,136 @@ app.use(express.static(path.join(__dirname, 'build')));
 // Store submissions (in production, use database)
 let submissions = [];
 
+// Long-lived Python grading worker (models are loaded once, not per request)
+const worker = {
+  process: null,
+  ready: false,
+  nextId: 1,
+  pending: new Map(),
+  queued: []
+};
+let shuttingDown = false;
+
+function failPending(message) {
+  worker.pending.forEach((request) => request.reject(new Error(message)));
+  worker.pending.clear();
+  worker.queued = [];
+}
+
+function startWorker() {
+  const args = ['./python/main.py', '--serve'];
+  if (process.env.GRADER_CRITERIA) {
+    args.push('--criteria', process.env.GRADER_CRITERIA);
+  }
+  if (process.env.GRADER_BATCH === '1') {
+    // Micro-batch concurrent requests; replies come back out of order, matched by id
+    args.push('--batch');
+    if (process.env.GRADER_MAX_BATCH_SIZE) args.push('--max-batch-size', process.env.GRADER_MAX_BATCH_SIZE);
+    if (process.env.GRADER_MAX_WAIT_MS) args.push('--max-wait-ms', process.env.GRADER_MAX_WAIT_MS);
+    if (process.env.GRADER_MAX_QUEUE) args.push('--max-queue', process.env.GRADER_MAX_QUEUE);
+  }
+  const child = spawn('python3', args, {
+    env: process.env // Just pass the existing environment
+  });
+  worker.process = child;
+  worker.ready = false;
+
+  readline.createInterface({ input: child.stdout }).on('line', (line) => {
+    let message;
+    try {
+      message = JSON.parse(line);
+    } catch (parseError) {
+      console.error('Invalid worker output:', line);
+      return;
+    }
+
+    if (message.event === 'ready') {
+      console.log('Python worker ready, startup:', JSON.stringify(message.startup));
+      worker.ready = true;
+      if (child.stdin.writable) {
+        worker.queued.forEach((payload) => child.stdin.write(payload));
+      }
+      worker.queued = [];
+      return;
+    }
+
+    const request = worker.pending.get(message.id);
+    if (!request) return;
+    worker.pending.delete(message.id);
+    if (message.ok) {
+      request.resolve(message);
+    } else {
+      const error = new Error(message.error);
+      error.status = message.status;
+      request.reject(error);
+    }
+  });
+
+  child.stderr.on('data', (data) => {
+    console.error('Python stderr:', data.toString());
+  });
+
+  child.on('error', (error) => {
+    console.error('Failed to start Python worker:', error);
+  });
+
+  // A write to a worker that just died fails with EPIPE; unhandled, it would crash the server
+  child.stdin.on('error', (error) => {
+    console.error('Python worker stdin error:', error.message);
+    failPending('Grading worker exited');
+    // The exit handler restarts it
+    child.kill();
+  });
+
+  child.on('exit', (code, signal) => {
+    console.error(`Python worker exited (code ${code}, signal ${signal})`);
+    worker.process = null;
+    worker.ready = false;
+    failPending('Grading worker exited');
+    if (!shuttingDown) {
+      setTimeout(startWorker, 1000);
+    }
+  });
+}
+
+function callWorker(message) {
+  return new Promise((resolve, reject) => {
+    if (!worker.process || !worker.process.stdin.writable) {
+      return reject(new Error('Grading worker is not running'));
+    }
+    const id = worker.nextId++;
+    const payload = JSON.stringify({ ...message, id }) + '\n';
+    worker.pending.set(id, { resolve, reject });
+    if (worker.ready) {
+      worker.process.stdin.write(payload);
+    } else {
+      worker.queued.push(payload);
+    }
+  });
+}
+
+function gradeWithWorker(introduction, duration, submission) {
+  // The worker persists the result under the submission id when GRADER_STORE_PATH is set
+  return callWorker({ introduction, duration, submission }).then((message) => message.result);
+}
+
+function storedResult(submissionId) {
+  return callWorker({ op: 'results', submission: submissionId }).then((message) => message.record);
+}
+
+function stopWorker() {
+  shuttingDown = true;
+  if (worker.process && worker.process.stdin.writable) {
+    worker.process.stdin.write(JSON.stringify({ op: 'shutdown' }) + '\n');
+    worker.process.stdin.end();
+  }
+}
+
+process.on('SIGTERM', () => {
+  stopWorker();
+  process.exit(0);
+});
+
 // Health check endpoint
 app.get('/api/health', (req, res) => {
   res.json({ 
@@ -49,79 +180,40 @@ app.post('/api/analyze-introduction', (req, res) => {
 
     submissions.push(submission);
 
-    // Call Python script with proper Java configuration
-    const pythonProcess = spawn('python3', [
-    './python/main.py', 
-    JSON.stringify({
-        introduction: introduction,
-        duration: parseFloat(duration)
-        })
-    ], {
-        env: process.env // Just pass the existing environment
-    });
-
-    let result = '';
-    let errorOutput = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      result += data.toString();
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      errorOutput += data.toString();
-      console.error('Python stderr:', data.toString());
-    });
-
-    pythonProcess.on('close', (code) => {
-      if (code === 0) {
-        try {
-          const gradingResult = JSON.parse(result);
-          
-          // Update submission with results
-          const submissionIndex = submissions.findIndex(s => s.id === submission.id);
-          if (submissionIndex !== -1) {
-            submissions[submissionIndex] = {
-              ...submissions[submissionIndex],
-              status: 'completed',
-              gradingResult: gradingResult
-            };
-          }
-
-          res.json({
-            success: true,
-            message: 'Analysis completed successfully',
-            data: gradingResult
-          });
+    // Grade through the persistent Python worker
+    gradeWithWorker(introduction, parseFloat(duration), submission.id)
+      .then((gradingResult) => {
+        // Update submission with results
+        const submissionIndex = submissions.findIndex(s => s.id === submission.id);
+        if (submissionIndex !== -1) {
+          submissions[submissionIndex] = {
+            ...submissions[submissionIndex],
+            status: 'completed',
+            gradingResult: gradingResult
+          };
+        }
 
-        } catch (parseError) {
-          console.error('JSON Parse Error:', parseError);
-          console.error('Raw output:', result);
-          res.status(500).json({
+        res.json({
+          success: true,
+          message: 'Analysis completed successfully',
+          data: gradingResult
+        });
+      })
+      .catch((error) => {
+        console.error('Analysis failed:', error);
+        if (error.status === 429) {
+          return res.status(429).json({
             success: false,
-            message: 'Error parsing analysis results',
-            error: errorOutput || parseError.message,
-            rawOutput: result
+            message: 'Grading is busy, please retry shortly',
+            error: error.message
           });
         }
-      } else {
-        console.error('Python process exited with code:', code);
         res.status(500).json({
           success: false,
           message: 'Analysis failed',
-          error: errorOutput,
-          exitCode: code
+          error: error.message
         });
-      }
-    });
-
-    pythonProcess.on('error', (error) => {
-      console.error('Failed to start Python process:', error);
-      res.status(500).json({
-        success: false,
-        message: 'Failed to start analysis process',
-        error: error.message
       });
-    });
 
   } catch (error) {
     console.error('Server Error:', error);
@@ -139,17 +231,40 @@ app.get('/api/results/:submissionId', (req, res) => {
     const { submissionId } = req.params;
     const submission = submissions.find(s => s.id === submissionId);
     
-    if (!submission) {
-      return res.status(404).json({
-        success: false,
-        message: 'Submission not found'
+    if (submission) {
+      return res.json({
+        success: true,
+        data: submission
       });
     }
 
-    res.json({
-      success: true,
-      data: submission
-    });
+    // Not graded since this server started: look in the worker's result store
+    storedResult(submissionId)
+      .then((record) => {
+        if (!record) {
+          return res.status(404).json({
+            success: false,
+            message: 'Submission not found'
+          });
+        }
+        res.json({
+          success: true,
+          data: {
+            id: record.submissionId,
+            introduction: record.introduction,
+            duration: record.duration,
+            timestamp: new Date(record.created * 1000).toISOString(),
+            status: 'completed',
+            gradingResult: record.result
+          }
+        });
+      })
+      .catch(() => {
+        res.status(404).json({
+          success: false,
+          message: 'Submission not found'
+        });
+      });
 
   } catch (error) {
     res.status(500).json({
@@ -215,6 +330,7 @@ app.use((error, req, res, next) => {
 });
 
 // Start server
+startWorker();
 app.listen(PORT, () => {
   console.log(`🚀 Server is running on port ${PORT}`);
   console.log(`📊 Health check: http://localhost:${PORT}/api/health`);